@@ -0,0 +1,199 @@
+import numpy as np
+
+# === АНАЛИТИКА ПОТРЕБЛЕНИЯ (NumPy) ===
+# Ряды показаний многих пользователей обрабатываются разом как склеенные массивы:
+#   seg    — номер ряда (пользователь/ресурс, 0..k-1) для каждой точки, ряды идут подряд,
+#   days   — день показания (дней с 1970-01-01), по возрастанию внутри ряда,
+#   values — показание счётчика (накопительное).
+# Никаких циклов по пользователям или показаниям — только векторные операции.
+
+# Сдвиг, делающий дни разных рядов одной возрастающей осью: seg * OFFSET + day
+OFFSET = 1 << 20
+
+SEASON_NAMES = ("зима", "весна", "лето", "осень")
+
+
+def series_from_rows(rows):
+    # rows — (ключ ряда, 'ГГГГ-ММ-ДД', показание), отсортированные по ключу и дате
+    keys, dates, values = zip(*rows) if rows else ((), (), ())
+    keys = np.asarray(keys)
+    change = np.ones(len(keys), dtype=bool)
+    change[1:] = keys[1:] != keys[:-1]
+    seg = np.cumsum(change) - 1
+    days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+    return keys[change], seg, days, np.asarray(values, dtype=np.float64)
+
+
+def _bounds(seg):
+    # Индексы первой и последней точки каждого ряда
+    starts = np.flatnonzero(np.r_[True, seg[1:] != seg[:-1]])
+    ends = np.r_[starts[1:], len(seg)] - 1
+    return starts, ends
+
+
+# === ИНТЕРВАЛЫ И СУТОЧНЫЙ РАСХОД ===
+def intervals(seg, days, values):
+    # Для каждой точки — интервал от предыдущего показания того же ряда.
+    # rate — расход в сутки, нормированный на длину интервала; у первой точки ряда NaN.
+    n = len(seg)
+    valid = np.zeros(n, dtype=bool)
+    valid[1:] = seg[1:] == seg[:-1]
+    gap = np.zeros(n, dtype=np.int64)
+    gap[1:] = days[1:] - days[:-1]
+    delta = np.full(n, np.nan)
+    delta[1:] = values[1:] - values[:-1]
+    valid &= gap > 0
+    delta[~valid] = np.nan
+    rate = np.full(n, np.nan)
+    rate[valid] = delta[valid] / gap[valid]
+    return delta, gap, rate
+
+def running_mean(seg, delta):
+    # Средний расход по всем интервалам ряда до текущей точки включительно
+    # (колонка «Сред.» истории) — накопительные суммы со сбросом на границе ряда
+    known = ~np.isnan(delta)
+    total = np.cumsum(np.where(known, delta, 0.0))
+    count = np.cumsum(known)
+    starts, _ = _bounds(seg)
+    lengths = np.diff(np.r_[starts, len(seg)])
+    total -= np.repeat(total[starts] - np.where(known[starts], delta[starts], 0.0), lengths)
+    count -= np.repeat(count[starts] - known[starts], lengths)
+    mean = np.full(len(seg), np.nan)
+    np.divide(total, count, out=mean, where=count > 0)
+    return mean
+
+
+# === МЕСЯЦЫ И СЕЗОНЫ ===
+def _month_start(month_index):
+    return month_index.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+
+def monthly(seg, days, values):
+    # Расход по календарным месяцам. Показание накопительное, поэтому расход за
+    # [начало, конец) месяца — разность линейно интерполированных показаний на границах:
+    # интервал, пересекающий границу месяца, делится пропорционально дням.
+    starts, ends = _bounds(seg)
+    first_month = days[starts].astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    last_month = days[ends].astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    counts = last_month - first_month + 1
+
+    month_seg = np.repeat(np.arange(len(starts)), counts)
+    position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    month = first_month[month_seg] + position
+
+    first_day = days[starts][month_seg]
+    last_day = days[ends][month_seg]
+    lo = np.clip(_month_start(month), first_day, last_day)
+    hi = np.clip(_month_start(month + 1), first_day, last_day)
+
+    axis = seg.astype(np.int64) * OFFSET + days
+    base = month_seg.astype(np.int64) * OFFSET
+    consumption = np.interp(base + hi, axis, values) - np.interp(base + lo, axis, values)
+    covered = hi - lo
+    per_day = np.full(len(month), np.nan)
+    np.divide(consumption, covered, out=per_day, where=covered > 0)
+    return {
+        "seg": month_seg,
+        "month": month,  # месяцев с 1970-01
+        "consumption": consumption,
+        "days": covered,
+        "per_day": per_day,
+    }
+
+def seasonal(months):
+    # Зима — декабрь-февраль; декабрь относится к зиме следующего года
+    calendar_month = months["month"] % 12
+    season = ((calendar_month + 1) % 12) // 3
+    season_year = 1970 + (months["month"] + 1) // 12
+    # Месяцы идут по порядку, поэтому (ряд, год, сезон) меняется только на границах групп
+    key = (months["seg"].astype(np.int64) * 1000 + season_year) * 4 + season
+    change = np.r_[True, key[1:] != key[:-1]] if len(key) else np.zeros(0, dtype=bool)
+    group = np.cumsum(change) - 1
+    consumption = np.bincount(group, weights=months["consumption"])
+    covered = np.bincount(group, weights=months["days"])
+    per_day = np.full(len(consumption), np.nan)
+    np.divide(consumption, covered, out=per_day, where=covered > 0)
+    return {
+        "seg": months["seg"][change],
+        "year": season_year[change],
+        "season": season[change],
+        "consumption": consumption,
+        "days": covered,
+        "per_day": per_day,
+    }
+
+def year_over_year(months):
+    # Сравнение месяца с тем же месяцем прошлого года (по суточному расходу,
+    # чтобы неполные месяцы на краях ряда сравнивались честно)
+    key = months["seg"].astype(np.int64) * OFFSET + months["month"]
+    prev_key = key - 12
+    idx = np.searchsorted(key, prev_key)
+    idx_clipped = np.minimum(idx, len(key) - 1)
+    found = (idx < len(key)) & (key[idx_clipped] == prev_key)
+    prev_per_day = np.where(found, months["per_day"][idx_clipped], np.nan)
+    change = np.full(len(key), np.nan)
+    np.divide(months["per_day"] - prev_per_day, prev_per_day, out=change,
+              where=found & (prev_per_day > 0))
+    return {"prev_per_day": prev_per_day, "change": change}
+
+
+# === АНОМАЛИИ ===
+def anomalies(seg, rate, z_threshold=3.0, iqr_factor=3.0, min_points=8):
+    # Флаги по суточному расходу внутри каждого ряда: |z| > z_threshold
+    # и выход за [Q1 - k·IQR, Q3 + k·IQR]; аномалия — когда сработали оба.
+    # Ряды короче min_points не оцениваются.
+    n_seg = int(seg.max()) + 1 if len(seg) else 0
+    ok = ~np.isnan(rate)
+    seg_ok = seg[ok]
+    rate_ok = rate[ok]
+    count = np.bincount(seg_ok, minlength=n_seg)
+    total = np.bincount(seg_ok, weights=rate_ok, minlength=n_seg)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        deviation = rate_ok - mean[seg_ok]
+        std = np.sqrt(np.bincount(seg_ok, weights=deviation * deviation, minlength=n_seg) / count)
+        z = np.full(len(rate), np.nan)
+        z[ok] = np.where(std[seg_ok] > 0, deviation / std[seg_ok], 0.0)
+
+    # Квартили: расход внутри ряда нормируется в [0, 0.5] и прибавляется к номеру ряда —
+    # одна сортировка по такому ключу упорядочивает все ряды сразу
+    low = np.full(n_seg, np.inf)
+    high = np.full(n_seg, -np.inf)
+    np.minimum.at(low, seg_ok, rate_ok)
+    np.maximum.at(high, seg_ok, rate_ok)
+    span = np.where(high > low, high - low, 1.0)
+    order = np.argsort(seg_ok + (rate_ok - low[seg_ok]) / span[seg_ok] * 0.5)
+    sorted_rate = np.append(rate_ok[order], np.nan)  # NaN — квартиль пустого ряда
+    seg_start = np.cumsum(count) - count
+    last = np.maximum(count - 1, 0)
+    q1 = sorted_rate[np.where(count > 0, seg_start + last // 4, -1)]
+    q3 = sorted_rate[np.where(count > 0, seg_start + (3 * last) // 4, -1)]
+    iqr = q3 - q1
+
+    enough = np.zeros(len(rate), dtype=bool)
+    enough[ok] = count[seg_ok] >= min_points
+    z_flag = np.zeros(len(rate), dtype=bool)
+    iqr_flag = np.zeros(len(rate), dtype=bool)
+    with np.errstate(invalid="ignore"):
+        z_flag[ok] = np.abs(z[ok]) > z_threshold
+        iqr_flag[ok] = (rate_ok > q3[seg_ok] + iqr_factor * iqr[seg_ok]) | (rate_ok < q1[seg_ok] - iqr_factor * iqr[seg_ok])
+    return {
+        "z": z,
+        "z_flag": z_flag & enough,
+        "iqr_flag": iqr_flag & enough,
+        "flag": z_flag & iqr_flag & enough,
+    }
+
+
+def analyze(seg, days, values):
+    delta, gap, rate = intervals(seg, days, values)
+    months = monthly(seg, days, values)
+    return {
+        "delta": delta,
+        "gap": gap,
+        "rate": rate,
+        "mean": running_mean(seg, delta),
+        "months": months,
+        "seasons": seasonal(months),
+        "yoy": year_over_year(months),
+        "anomalies": anomalies(seg, rate),
+    }
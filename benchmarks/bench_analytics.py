@@ -0,0 +1,92 @@
+# analytics.py (NumPy) против цикла из прежнего monthly_stats: расход и среднее
+# по каждому показанию в чистом Python. Данные — ежедневные показания за N лет.
+# «same work» — те же расход и среднее векторно; «full analytics» — ещё месяцы,
+# сезоны, год к году и аномалии.
+# Python-цикл квадратичный по длине ряда, поэтому он меряется на нескольких
+# пользователях и экстраполируется на всех.
+#
+# Запуск: python benchmarks/bench_analytics.py [--users 10000] [--years 10] [--chunk 500]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import analytics
+
+START_DAY = int(np.datetime64("2015-01-01", "D").astype(np.int64))
+
+
+def make_chunk(rng, users, points):
+    seg = np.repeat(np.arange(users), points)
+    days = START_DAY + np.tile(np.arange(points), users)
+    rates = rng.gamma(4.0, 2.5, size=users * points)
+    rates[rng.random(users * points) < 0.001] *= 20  # редкие всплески (утечки)
+    values = np.cumsum(rates.reshape(users, points), axis=1).ravel()
+    return seg, days, values
+
+
+# Цикл прежнего monthly_stats: расход с прошлого показания и среднее по всем предыдущим
+def python_loop(data):
+    rows = []
+    consumptions = []
+    for i, (date_str, meter_val) in enumerate(data):
+        if i == 0:
+            rows.append((date_str, meter_val, "-", "-"))
+            continue
+        current_consumption = int(round(meter_val - data[i - 1][1]))
+        consumptions.append(current_consumption)
+        avg = int(round(sum(consumptions) / len(consumptions)))
+        rows.append((date_str, meter_val, current_consumption, avg))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--chunk", type=int, default=500, help="пользователей в одном векторном проходе")
+    parser.add_argument("--python-users", type=int, default=3)
+    args = parser.parse_args()
+
+    points = args.years * 365
+    rng = np.random.default_rng(42)
+
+    numpy_time = 0.0
+    numpy_same_work = 0.0
+    flagged = 0
+    for offset in range(0, args.users, args.chunk):
+        users = min(args.chunk, args.users - offset)
+        seg, days, values = make_chunk(rng, users, points)
+        started = time.perf_counter()
+        result = analytics.analyze(seg, days, values)
+        numpy_time += time.perf_counter() - started
+        flagged += int(result["anomalies"]["flag"].sum())
+        started = time.perf_counter()
+        delta, _, _ = analytics.intervals(seg, days, values)
+        analytics.running_mean(seg, delta)
+        numpy_same_work += time.perf_counter() - started
+
+    seg, days, values = make_chunk(rng, args.python_users, points)
+    dates = days.astype("datetime64[D]").astype(str)
+    started = time.perf_counter()
+    for user in range(args.python_users):
+        mask = seg == user
+        python_loop(list(zip(dates[mask].tolist(), values[mask].tolist())))
+    python_per_user = (time.perf_counter() - started) / args.python_users
+    python_time = python_per_user * args.users
+
+    print(f"{args.users} users x {points} daily readings ({args.users * points / 1e6:.1f}M points)")
+    print(f"python loop (extrapolated): {python_time:>10.1f} s   ({python_per_user * 1000:.1f} ms/user)")
+    print(f"numpy, same work:           {numpy_same_work:>10.2f} s   ({numpy_same_work / args.users * 1000:.4f} ms/user)"
+          f"  speedup {python_time / numpy_same_work:.0f}x")
+    print(f"numpy, full analytics:      {numpy_time:>10.1f} s   ({numpy_time / args.users * 1000:.3f} ms/user)"
+          f"  speedup {python_time / numpy_time:.0f}x")
+    print(f"anomalies flagged:          {flagged:>10}")
+
+
+if __name__ == "__main__":
+    main()
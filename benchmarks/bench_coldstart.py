@@ -0,0 +1,120 @@
+# Холодный старт бота на большой базе: сколько проходит от запуска процесса
+# meter.py до ответа на первое обновление и сколько памяти (RSS) у процесса
+# в этот момент. База засеивается один раз (--users пользователей по три счётчика
+# с двумя показаниями) и переиспользуется между прогонами через --workdir.
+# Отдельно меряется «import meter» — во сколько обходится импорт обработчиков.
+#
+# Запуск: python benchmarks/bench_coldstart.py [--users 1000000] [--runs 5] [--workdir /tmp/meter-cold]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_telegram import FakeTelegram, message_update
+from loadtest import BOOTSTRAP, TOKEN, db_size, rss_mb
+
+
+# === ДАННЫЕ ===
+def seed(workdir, users):
+    # Схема — через meter.init_db(), данные — пакетными INSERT ... SELECT
+    script = f'''
+import os, sys
+sys.path.insert(0, {REPO_DIR!r})
+os.environ["BOT_TOKEN"] = {TOKEN!r}
+import db, meter
+meter.init_db()
+with db.transaction() as cursor:
+    cursor.execute("""
+        WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < ?)
+        INSERT OR IGNORE INTO users (user_id) SELECT x FROM n
+    """, ({users},))
+    cursor.execute("""
+        INSERT OR IGNORE INTO meters (user_id, resource, name)
+        SELECT u.user_id, d.resource, d.name FROM users u,
+            (SELECT 'electricity' AS resource, 'Электричество' AS name
+             UNION ALL SELECT 'water', 'Вода' UNION ALL SELECT 'gas', 'Газ') d
+    """)
+    cursor.execute("""
+        INSERT INTO readings (meter_id, date, value, delta, run_count, run_sum)
+        SELECT meter_id, '2025-01-10', 100, NULL, 0, 0 FROM meters
+        UNION ALL
+        SELECT meter_id, '2025-02-10', 150, 50, 1, 50 FROM meters
+    """)
+os._exit(0)
+'''
+    subprocess.run([sys.executable, "-c", script], cwd=workdir, check=True)
+
+
+# === ЗАМЕРЫ ===
+def import_seconds(workdir):
+    script = "import time; t = time.perf_counter(); import meter; print(time.perf_counter() - t)"
+    env = dict(os.environ, BOT_TOKEN=TOKEN, PYTHONPATH=REPO_DIR)
+    out = subprocess.run([sys.executable, "-c", script], cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def first_update(workdir, server):
+    # Обновление кладётся в очередь фейкового API до запуска: бот заберёт его первым getUpdates
+    answered = threading.Event()
+    server.on_call = lambda method, params: answered.set() if method == "sendMessage" else None
+    server.push_update(message_update(1, "/help"))
+    env = dict(os.environ, BOT_TOKEN=TOKEN, PYTHONPATH=REPO_DIR, LOG_LEVEL="WARNING")
+    started = time.perf_counter()
+    bot = subprocess.Popen(
+        [sys.executable, "-c", BOOTSTRAP, server.api_url, os.path.join(REPO_DIR, "meter.py")],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        if not answered.wait(120):
+            raise RuntimeError("бот не ответил за 120 с")
+        elapsed = time.perf_counter() - started
+        return elapsed, rss_mb(bot.pid)
+    finally:
+        bot.kill()
+        bot.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workdir", help="каталог с базой; засеивается, если базы нет")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="meter-cold-")
+    os.makedirs(workdir, exist_ok=True)
+    if not os.path.exists(os.path.join(workdir, "my_meter.db")):
+        started = time.perf_counter()
+        seed(workdir, args.users)
+        print(f"seeded {args.users} users in {time.perf_counter() - started:.1f}s")
+    print(f"database: {db_size(workdir) / 1e6:.0f} MB in {workdir}")
+
+    server = FakeTelegram().start()
+    imports, starts, rss = [], [], []
+    for _ in range(args.runs):
+        imports.append(import_seconds(workdir))
+        elapsed, mb = first_update(workdir, server)
+        starts.append(elapsed)
+        rss.append(mb)
+    server.stop()
+
+    print(f"{'':<24}{'median':>10}{'min':>10}{'max':>10}")
+    for name, values, scale, unit in (
+        ("import meter", imports, 1000, "ms"),
+        ("time to first update", starts, 1000, "ms"),
+        ("RSS at first update", rss, 1, "MB"),
+    ):
+        print(f"{name + ', ' + unit:<24}{statistics.median(values) * scale:>10.0f}"
+              f"{min(values) * scale:>10.0f}{max(values) * scale:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
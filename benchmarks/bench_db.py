@@ -0,0 +1,113 @@
+# Сравнение задержки БД в обработчике: старый get_db() (connect/close на каждый вызов)
+# против пула db.py (соединение на поток, WAL, кэш подготовленных запросов).
+#
+# Запуск: python benchmarks/bench_db.py [--users 1000] [--calls 5000] [--threads 4]
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS electricity (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        meter REAL NOT NULL,
+        date TEXT NOT NULL,
+        user_id INTEGER NOT NULL
+    )
+'''
+INDEX = "CREATE INDEX IF NOT EXISTS idx_electricity_user_date ON electricity (user_id, date)"
+
+
+def prepare(path, users):
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    conn.execute(INDEX)
+    rows = [(u, 100.0 + d, f"2024-{1 + d // 28:02d}-{1 + d % 28:02d}") for u in range(users) for d in range(12 * 28)]
+    conn.executemany("INSERT INTO electricity (user_id, meter, date) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+# Та же последовательность запросов, что и в save_meter_reading
+def handler_old(path, user_id, value):
+    conn = sqlite3.connect(path, timeout=10.0)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM electricity WHERE user_id = ? AND date = date('now') LIMIT 1", (user_id,))
+    cursor.fetchone()
+    cursor.execute("SELECT meter FROM electricity WHERE user_id = ? ORDER BY date DESC LIMIT 1", (user_id,))
+    cursor.fetchone()
+    cursor.execute("INSERT INTO electricity (user_id, meter, date) VALUES (?, ?, '2030-01-01')", (user_id, value))
+    conn.commit()
+    conn.close()
+
+
+def handler_pooled(path, user_id, value):
+    db.fetchone("SELECT 1 FROM electricity WHERE user_id = ? AND date = date('now') LIMIT 1", (user_id,))
+    db.fetchone("SELECT meter FROM electricity WHERE user_id = ? ORDER BY date DESC LIMIT 1", (user_id,))
+    db.execute("INSERT INTO electricity (user_id, meter, date) VALUES (?, ?, '2030-01-01')", (user_id, value))
+
+
+def run(handler, path, users, calls, threads):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        local = []
+        for i in range(offset, calls, threads):
+            start = time.perf_counter()
+            handler(path, i % users, 1000.0 + i)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "calls/s": calls / elapsed,
+        "mean ms": statistics.mean(latencies) * 1000,
+        "p50 ms": latencies[len(latencies) // 2] * 1000,
+        "p99 ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_path = os.path.join(tmp, "old.db")
+        new_path = os.path.join(tmp, "pooled.db")
+        prepare(old_path, args.users)
+        prepare(new_path, args.users)
+        db.DB_PATH = new_path
+
+        results = {
+            "get_db()": run(handler_old, old_path, args.users, args.calls, args.threads),
+            "db pool": run(handler_pooled, new_path, args.users, args.calls, args.threads),
+        }
+        db.close_all()
+
+    print(f"{'':<10}" + "".join(f"{k:>12}" for k in next(iter(results.values()))))
+    for name, stats in results.items():
+        print(f"{name:<10}" + "".join(f"{v:>12.3f}" for v in stats.values()))
+
+
+if __name__ == "__main__":
+    main()
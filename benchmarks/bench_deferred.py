@@ -0,0 +1,98 @@
+# Отложенные напоминания: по задаче APScheduler на каждое нажатие «Напомнить завтра»
+# против строк deferred_reminders в SQLite и одной пакетной задачи.
+# Меряется память планировщика/очереди и время срабатывания всех напоминаний.
+#
+# Запуск: python benchmarks/bench_deferred.py [--reminders 100000]
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import broadcast
+import db
+import reminders
+
+
+def bench_scheduler_jobs(count):
+    fired = 0
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def send_remind_message_to_user(user_id):
+        nonlocal fired
+        with lock:
+            fired += 1
+            if fired == count:
+                done.set()
+
+    scheduler = BackgroundScheduler()
+    scheduler.start(paused=True)
+    tracemalloc.start()
+    started = time.perf_counter()
+    run_date = datetime.now() + timedelta(seconds=1)
+    for user_id in range(count):
+        scheduler.add_job(lambda user_id=user_id: send_remind_message_to_user(user_id), 'date',
+                          run_date=run_date, misfire_grace_time=None)
+    scheduled = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    fire_started = time.perf_counter()
+    scheduler.resume()
+    done.wait()
+    firing = time.perf_counter() - fire_started
+    scheduler.shutdown(wait=False)
+    return scheduled, memory, firing
+
+
+def bench_deferred_table(count, path):
+    db.DB_PATH = path
+    with db.transaction() as cursor:
+        broadcast.create_tables(cursor)
+        reminders.create_tables(cursor)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    day = datetime.now().strftime("%Y-%m-%d")
+    for user_id in range(count):
+        reminders.defer(user_id, day)
+    scheduled = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    broadcaster = broadcast.Broadcaster(lambda user_id, text, reply_markup: True, rate=1e9, workers=8)
+    fire_started = time.perf_counter()
+    user_ids = reminders.due(day)
+    broadcaster.enqueue("deferred:bench", user_ids, "📢 Напоминание: пора ввести показания!")
+    reminders.clear(day)
+    broadcaster.run("deferred:bench")
+    firing = time.perf_counter() - fire_started
+    db.close_all()
+    return scheduled, memory, firing
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reminders", type=int, default=100000)
+    args = parser.parse_args()
+
+    results = {"APScheduler jobs": bench_scheduler_jobs(args.reminders)}
+    with tempfile.TemporaryDirectory() as tmp:
+        results["deferred table"] = bench_deferred_table(args.reminders, os.path.join(tmp, "bench.db"))
+
+    print(f"{args.reminders} deferred reminders")
+    print(f"{'':<18}{'schedule s':>12}{'memory MB':>12}{'firing s':>12}")
+    for name, (scheduled, memory, firing) in results.items():
+        print(f"{name:<18}{scheduled:>12.2f}{memory / 2**20:>12.1f}{firing:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
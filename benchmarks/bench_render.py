@@ -0,0 +1,136 @@
+# Отрисовка сообщений: как было (regex на каждый вызов, новая ReplyKeyboardMarkup
+# на каждое меню, InlineKeyboardMarkup на каждого получателя, три отправки при вводе
+# показаний) против render.py (таблица экранирования, готовый JSON клавиатур,
+# шаблоны, одно сообщение с меню).
+# Меряются CPU на операцию и выделения памяти (tracemalloc); для ввода показаний —
+# ещё и полный путь через telebot до локального фейкового Bot API.
+#
+# Запуск: python benchmarks/bench_render.py [--n 20000] [--sends 300]
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+import telebot
+
+import render
+from fake_telegram import FakeTelegram
+
+MENU_ROWS = [["⚡ Электричество", "💧 Вода", "🔥 Газ"], ["📆 История", "📈 График"]]
+MENU_KEYBOARD = render.reply_keyboard(MENU_ROWS)
+
+
+# === КАК БЫЛО ===
+def old_escape(text):
+    escape_chars = r'_*[]()~`>#+-=|{}.!'
+    return re.sub(r'([%s])' % re.escape(escape_chars), r'\\\1', text)
+
+def old_menu():
+    keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
+    keyboard.row(*(telebot.types.KeyboardButton(text) for text in MENU_ROWS[0]))
+    keyboard.row(*(telebot.types.KeyboardButton(text) for text in MENU_ROWS[1]))
+    return keyboard.to_json()  # telebot сериализует при каждой отправке
+
+def old_reminder_keyboard():
+    keyboard = telebot.types.InlineKeyboardMarkup()
+    keyboard.add(
+        telebot.types.InlineKeyboardButton("⏰ Напомнить завтра", callback_data="remind_tomorrow"),
+        telebot.types.InlineKeyboardButton("✅ Уже ввёл", callback_data="remind_done"),
+    )
+    return keyboard.to_json()
+
+def old_saved_messages(value, consumption, unit):
+    return [
+        (old_escape(f"✅ Показания сохранены: {value} {unit}"), None),
+        (old_escape(f"💡 Расход с прошлого раза: {consumption} {unit}"), None),
+        (old_escape("Выберите действие через меню:"), old_menu()),
+    ]
+
+
+# === КАК СТАЛО ===
+def new_escape(text):
+    return render.escape_markdown_v2(text)
+
+def new_menu():
+    return MENU_KEYBOARD
+
+def new_reminder_keyboard():
+    return render.REMINDER_KEYBOARD
+
+def new_saved_messages(value, consumption, unit):
+    text = render.SAVED.format(value=value, unit=unit) + "\n" + render.CONSUMPTION.format(consumption=consumption, unit=unit)
+    return [(text, MENU_KEYBOARD)]
+
+
+# === ИЗМЕРЕНИЕ ===
+def measure(func, n):
+    func()  # прогрев
+    started = time.process_time()
+    for _ in range(n):
+        func()
+    cpu = (time.process_time() - started) / n
+    # Пик памяти сверх исходного уровня за вызов — сколько временных объектов создаётся
+    tracemalloc.start()
+    total = 0
+    for _ in range(200):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return cpu, total / 200
+
+
+def send_all(bot, messages):
+    for text, markup in messages:
+        bot.send_message(1, text, parse_mode="MarkdownV2", reply_markup=markup)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20000, help="повторов микробенчмарков")
+    parser.add_argument("--sends", type=int, default=300, help="вводов показаний через telebot")
+    args = parser.parse_args()
+
+    text = "📋 Вода: 12.5 м³ (+3.2) — [ср. 2.1] по 01.02.2025!"
+    cases = [
+        ("escape", lambda: old_escape(text), lambda: new_escape(text)),
+        ("menu keyboard", old_menu, new_menu),
+        ("reminder keyboard", old_reminder_keyboard, new_reminder_keyboard),
+        ("saved reply", lambda: old_saved_messages(125, 3, "м³"), lambda: new_saved_messages(125, 3, "м³")),
+    ]
+    print(f"{'':<20}{'old µs':>10}{'new µs':>10}{'x':>8}{'old peak B':>12}{'new peak B':>12}")
+    for name, old, new in cases:
+        old_cpu, old_alloc = measure(old, args.n)
+        new_cpu, new_alloc = measure(new, args.n)
+        print(f"{name:<20}{old_cpu * 1e6:>10.2f}{new_cpu * 1e6:>10.2f}{old_cpu / new_cpu:>8.1f}"
+              f"{old_alloc:>12.0f}{new_alloc:>12.0f}")
+
+    # Полный путь: подготовка + запросы telebot к фейковому API (без задержки сети).
+    # CPU процесса включает и поток фейкового сервера — на каждый вызов API он тоже тратит время
+    server = FakeTelegram().start()
+    telebot.apihelper.API_URL = server.api_url
+    bot = telebot.TeleBot("123:bench")
+    print()
+    print(f"{'reading saved':<20}{'API calls':>10}{'CPU ms':>10}{'wall ms':>10}")
+    for name, build in (("old", old_saved_messages), ("new", new_saved_messages)):
+        send_all(bot, build(125, 3, "м³"))
+        calls_before = len(server.calls)
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        for i in range(args.sends):
+            send_all(bot, build(125 + i, 3, "м³"))
+        cpu = (time.process_time() - cpu_started) / args.sends
+        wall = (time.perf_counter() - wall_started) / args.sends
+        calls = (len(server.calls) - calls_before) / args.sends
+        print(f"{name:<20}{calls:>10.0f}{cpu * 1000:>10.2f}{wall * 1000:>10.2f}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
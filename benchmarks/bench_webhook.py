@@ -0,0 +1,142 @@
+# Пропускная способность и задержка: bot.polling против webhook.py.
+# Бот работает против локального фейкового Bot API (fake_telegram.py) с искусственной
+# сетевой задержкой; каждый пользователь по кругу запрашивает «📆 История», следующий
+# запрос уходит после того, как бот прислал ему меню (замкнутый цикл).
+#
+# Запуск: python benchmarks/bench_webhook.py [--users 50] [--requests 10] [--latency 0.02]
+import argparse
+import itertools
+import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+MENU_TEXT = "Выберите действие через меню"
+
+
+def seed(users):
+    import db
+    import readings
+
+    for user_id in range(1, users + 1):
+        db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+        meter_id = readings.add_meter(user_id, "electricity", "Электричество")
+        for day in range(1, 29):
+            readings.insert_reading(meter_id, 100.0 * day, f"2024-01-{day:02d}")
+
+
+def run_mode(mode, users, requests_per_user, latency):
+    os.chdir(tempfile.mkdtemp())
+    os.environ["BOT_TOKEN"] = "123:bench"
+
+    import logging
+    import requests as http
+    import telebot
+    from fake_telegram import FakeTelegram, message_update
+
+    server = FakeTelegram(latency=latency).start()
+    telebot.apihelper.API_URL = server.api_url
+
+    import meter
+    meter.create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    seed(users)
+
+    ready = queue.Queue()
+    server.on_call = lambda method, params: (
+        ready.put(int(params["chat_id"])) if method == "sendMessage" and MENU_TEXT in params.get("text", "") else None
+    )
+
+    if mode == "webhook":
+        import asyncio
+        import webhook
+        from aiohttp import web
+
+        started = threading.Event()
+        port_holder = {}
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            runner = web.AppRunner(webhook.create_app(meter.bot))
+            loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            loop.run_until_complete(site.start())
+            port_holder["port"] = site._server.sockets[0].getsockname()[1]
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        started.wait()
+        session = http.Session()
+        url = f"http://127.0.0.1:{port_holder['port']}{webhook.WEBHOOK_PATH}"
+        update_ids = itertools.count(1)
+
+        def deliver(update):
+            update["update_id"] = next(update_ids)
+            session.post(url, json=update)
+    else:
+        threading.Thread(target=lambda: meter.bot.polling(none_stop=True, interval=0, timeout=20), daemon=True).start()
+        deliver = server.push_update
+
+    total = users * requests_per_user
+    remaining = {user_id: requests_per_user for user_id in range(1, users + 1)}
+    sent_at = {}
+    latencies = []
+
+    started = time.perf_counter()
+    for user_id in remaining:
+        sent_at[user_id] = time.perf_counter()
+        deliver(message_update(user_id, "📆 История"))
+    while len(latencies) < total:
+        user_id = ready.get(timeout=120)
+        latencies.append(time.perf_counter() - sent_at[user_id])
+        remaining[user_id] -= 1
+        if remaining[user_id]:
+            sent_at[user_id] = time.perf_counter()
+            deliver(message_update(user_id, "📆 История"))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        "mode": mode,
+        "updates/s": total / elapsed,
+        "p50 ms": latencies[len(latencies) // 2] * 1000,
+        "p99 ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }))
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["polling", "webhook"])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка фейкового API, с")
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.users, args.requests, args.latency)
+        return
+
+    # Каждый режим — в отдельном процессе: meter.py держит состояние на уровне модуля
+    print(f"{'':<10}{'updates/s':>12}{'p50 ms':>12}{'p99 ms':>12}")
+    for mode in ("polling", "webhook"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--users", str(args.users),
+             "--requests", str(args.requests), "--latency", str(args.latency)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<10}{result['updates/s']:>12.1f}{result['p50 ms']:>12.1f}{result['p99 ms']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
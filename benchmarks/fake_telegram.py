@@ -0,0 +1,203 @@
+# Локальный фейковый Telegram Bot API для бенчмарков: отвечает на вызовы бота
+# без сети и записывает их с отметкой времени.
+#
+#   server = FakeTelegram(latency=0.02).start()
+#   server.inject(403, 0.01)  # 1% sendMessage отвечают «bot was blocked by the user»
+#   telebot.apihelper.API_URL = server.api_url
+import asyncio
+import json
+import random
+import threading
+import time
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls = []  # (время, метод, параметры)
+        self.on_call = None
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self._updates = []
+        self._update_id = 0
+        self._new_updates = None
+        self._loop = None
+        self._runner = None
+        self.faults = []  # (код, доля вызовов, методы, описание, retry_after)
+        self.injected = {}  # код -> сколько раз ответили ошибкой
+
+    @property
+    def api_url(self):
+        return f"http://{self.host}:{self.port}/bot{{0}}/{{1}}"
+
+    # === ВХОДЯЩИЕ ОБНОВЛЕНИЯ (getUpdates) ===
+    def push_update(self, update):
+        with self._lock:
+            self._update_id += 1
+            update["update_id"] = self._update_id
+            self._updates.append(update)
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._new_updates.set)
+        return update
+
+    def _pending_updates(self, offset, limit):
+        with self._lock:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            return self._updates[:limit]
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        deadline = time.monotonic() + float(params.get("timeout", 0))
+        while True:
+            self._new_updates.clear()
+            pending = self._pending_updates(offset, limit)
+            remaining = deadline - time.monotonic()
+            if pending or remaining <= 0:
+                return pending
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    # === ВНЕДРЕНИЕ ОШИБОК ===
+    ERROR_DESCRIPTIONS = {
+        400: "Bad Request: chat not found",
+        403: "Forbidden: bot was blocked by the user",
+        429: "Too Many Requests: retry after {retry_after}",
+    }
+
+    def inject(self, code, rate, methods=("sendMessage",), description=None, retry_after=1):
+        description = description or self.ERROR_DESCRIPTIONS.get(code, "Error").format(retry_after=retry_after)
+        self.faults.append((code, rate, set(methods), description, retry_after))
+        return self
+
+    def _fault(self, method):
+        for code, rate, methods, description, retry_after in self.faults:
+            if method in methods and random.random() < rate:
+                with self._lock:
+                    self.injected[code] = self.injected.get(code, 0) + 1
+                body = {"ok": False, "error_code": code, "description": description}
+                if code == 429:
+                    body["parameters"] = {"retry_after": retry_after}
+                return web.json_response(body, status=code)
+        return None
+
+    # === ОТВЕТЫ НА МЕТОДЫ ===
+    def _next_message(self, params):
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    def respond(self, method, params):
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method in ("sendMessage", "sendPhoto", "sendDocument"):
+            return self._next_message(params)
+        if method in ("editMessageText", "editMessageReplyMarkup"):
+            # Как и настоящий API, возвращаем изменённое сообщение
+            return {
+                "message_id": int(params.get("message_id", 0)),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        if method == "answerCallbackQuery":
+            return True
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "MeterBot", "username": "meter_bot"}
+        return True
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        if self.latency and method != "getUpdates":
+            await asyncio.sleep(self.latency)
+        self.calls.append((time.perf_counter(), method, params))
+        if self.faults:
+            fault = self._fault(method)
+            if fault is not None:
+                return fault
+        if self.on_call:
+            self.on_call(method, params)
+        result = self.respond(method, params)
+        if asyncio.iscoroutine(result):
+            result = await result
+        if isinstance(result, web.Response):
+            return result
+        return web.json_response({"ok": True, "result": result}, dumps=lambda o: json.dumps(o, ensure_ascii=False))
+
+    # === ЗАПУСК В ОТДЕЛЬНОМ ПОТОКЕ ===
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._new_updates = asyncio.Event()
+            app = web.Application(client_max_size=50 * 2**20)
+            app.router.add_route("*", "/bot{token}/{method}", self._handle)
+            self._runner = web.AppRunner(app, access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, self.host, self.port)
+            self._loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, daemon=True, name="fake-telegram").start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+# === КОНСТРУКТОРЫ ОБНОВЛЕНИЙ ===
+def message_update(user_id, text, message_id=1):
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "message": {
+            "message_id": message_id,
+            "from": user,
+            "chat": {"id": user_id, "type": "private"},
+            "date": int(time.time()),
+            "text": text,
+        }
+    }
+
+
+def callback_update(user_id, data, message_id=1):
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "callback_query": {
+            "id": f"{user_id}:{message_id}:{time.perf_counter_ns()}",
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "chat": {"id": user_id, "type": "private"},
+                "date": int(time.time()),
+                "text": "",
+            },
+        }
+    }
@@ -0,0 +1,364 @@
+# Нагрузочный тест бота целиком: meter.py (или webhook.py) запускается отдельным
+# процессом как в проде, но против локального фейкового Bot API (fake_telegram.py).
+# Виртуальные пользователи по сценариям жмут кнопки меню, вводят показания,
+# смотрят историю и удаляют запись с /undo; каждый следующий шаг уходит, когда бот
+# ответил на предыдущий (замкнутый цикл). Сеть не нужна.
+#
+# Запуск:
+#   python benchmarks/loadtest.py [--users 100] [--sessions 5] [--mix reader=5,historian=3,deleter=2]
+#                                 [--mode polling|webhook] [--latency 0.02] [--faults 429:0.01,403:0.002]
+#
+# Отчёт: шаги в секунду, перцентили задержки по типам шагов, ошибки/таймауты,
+# вызовы Bot API, рост базы и RSS процесса бота.
+import argparse
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests as http
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_telegram import FakeTelegram, callback_update, message_update
+
+TOKEN = "123:loadtest"
+RESOURCES = ("⚡ Электричество", "💧 Вода", "🔥 Газ")
+DEL_ALIASES = {"⚡ Электричество": "электричество", "💧 Вода": "вода", "🔥 Газ": "газ"}
+
+# Запуск настоящего entry point с подменённым адресом Bot API
+BOOTSTRAP = (
+    "import runpy, sys, telebot; telebot.apihelper.API_URL = sys.argv[1]; "
+    "sys.argv = sys.argv[2:]; runpy.run_path(sys.argv[0], run_name='__main__')"
+)
+
+
+# === КОГДА ШАГ ЗАВЕРШЁН ===
+# Бот заканчивает почти каждый сценарий меню (ReplyKeyboard); /del — вопросом
+# с inline-кнопками; выбор ресурса — просьбой ввести показания.
+def _markup(params):
+    markup = params.get("reply_markup") or ""
+    return markup if isinstance(markup, str) else json.dumps(markup)
+
+def menu_shown(method, params):
+    return '"keyboard"' in _markup(params)
+
+def prompt_shown(method, params):
+    return method == "sendMessage" and params.get("text", "").startswith("Введите показания")
+
+def delete_question(method, params):
+    return "confirm_delete:" in _markup(params)
+
+
+# === СЦЕНАРИИ ===
+# Шаг — (название, функция, строящая обновление по состоянию пользователя, условие завершения)
+def _confirm(user):
+    return callback_update(user.user_id, user.confirm_data, user.question_id)
+
+SCENARIOS = {
+    "reader": [
+        ("start", lambda u: message_update(u.user_id, "/start"), menu_shown),
+        ("resource", lambda u: message_update(u.user_id, u.resource), prompt_shown),
+        ("reading", lambda u: message_update(u.user_id, str(u.next_value())), menu_shown),
+    ],
+    "historian": [
+        ("history", lambda u: message_update(u.user_id, "📆 История"), menu_shown),
+    ],
+    "deleter": [
+        ("resource", lambda u: message_update(u.user_id, u.resource), prompt_shown),
+        ("reading", lambda u: message_update(u.user_id, str(u.next_value())), menu_shown),
+        ("del", lambda u: message_update(u.user_id, f"/del {u.today} {DEL_ALIASES[u.resource]}"), delete_question),
+        ("confirm", _confirm, menu_shown),
+        ("undo", lambda u: message_update(u.user_id, "/undo"), menu_shown),
+    ],
+}
+
+
+class VirtualUser:
+    def __init__(self, user_id, scenario, base_value):
+        self.user_id = user_id
+        self.scenario = scenario
+        self.resource = random.choice(RESOURCES)
+        self.value = base_value
+        self.today = datetime.now(timezone.utc).strftime("%d.%m.%Y")
+        self.confirm_data = None
+        self.question_id = 1
+        self.done = threading.Event()
+        self.predicate = None
+
+    def next_value(self):
+        self.value += 10
+        return self.value
+
+
+# === ДАННЫЕ ДО ТЕСТА ===
+def seed(workdir, users, history_days):
+    # История каждого пользователя: показание раз в ~30 дней по всем ресурсам
+    script = f'''
+import os, sys
+sys.path.insert(0, {REPO_DIR!r})
+os.environ["BOT_TOKEN"] = {TOKEN!r}
+import logging
+logging.disable(logging.CRITICAL)
+from datetime import date, timedelta
+import db, meter, readings
+meter.init_db()
+today = date.today()
+dates = [(today - timedelta(days=d)).isoformat() for d in range({history_days}, 0, -30)]
+db.executemany("INSERT OR IGNORE INTO users (user_id) VALUES (?)", [(u,) for u in range(1, {users} + 1)])
+for user_id in range(1, {users} + 1):
+    readings.ensure_meters(user_id, meter.DEFAULT_METERS)
+    for meter_id, _, _, _ in readings.list_meters(user_id):
+        readings.insert_many(meter_id, [(100.0 * i, d) for i, d in enumerate(dates)])
+        readings.refresh_rollup(meter_id, "0000-00-00")
+os._exit(0)
+'''
+    subprocess.run([sys.executable, "-c", script], cwd=workdir, check=True)
+    return len(range(history_days, 0, -30)) * 100.0
+
+
+def db_size(workdir):
+    # Логический размер (page_count * page_size): файл и WAL по отдельности
+    # зависят от того, когда прошёл checkpoint
+    conn = sqlite3.connect(f"file:{os.path.join(workdir, 'my_meter.db')}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+# === ПРОГОН ===
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="meter-load-")
+    base_value = seed(workdir, args.users, args.history_days)
+    size_before = db_size(workdir)
+
+    server = FakeTelegram(latency=args.latency).start()
+    for spec in filter(None, args.faults.split(",")):
+        code, rate = spec.split(":")
+        server.inject(int(code), float(rate))
+
+    weights = {}
+    for spec in args.mix.split(","):
+        name, weight = spec.split("=")
+        weights[name] = float(weight)
+    names = list(weights)
+    users = {
+        user_id: VirtualUser(user_id, random.choices(names, [weights[n] for n in names])[0], base_value)
+        for user_id in range(1, args.users + 1)
+    }
+
+    def on_call(method, params):
+        chat_id = params.get("chat_id")
+        user = users.get(int(chat_id)) if chat_id else None
+        if user is None or user.predicate is None or not user.predicate(method, params):
+            return
+        if user.predicate is delete_question:
+            user.confirm_data = next(
+                button["callback_data"]
+                for row in json.loads(_markup(params))["inline_keyboard"] for button in row
+                if button["callback_data"].startswith("confirm_delete:")
+            )
+            user.question_id = int(params.get("message_id", 1))
+        user.predicate = None
+        user.done.set()
+    server.on_call = on_call
+
+    env = dict(os.environ, BOT_TOKEN=TOKEN, PYTHONPATH=REPO_DIR, LOG_LEVEL="WARNING")
+    if args.mode == "webhook":
+        port = _free_port()
+        env.update(WEBHOOK_URL="https://example.invalid/bot", WEBHOOK_PORT=str(port), WEBHOOK_HOST="127.0.0.1")
+        entry = os.path.join(REPO_DIR, "webhook.py")
+    else:
+        entry = os.path.join(REPO_DIR, "meter.py")
+    bot = subprocess.Popen(
+        [sys.executable, "-c", BOOTSTRAP, server.api_url, entry],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    if args.mode == "webhook":
+        session = http.Session()
+        url = f"http://127.0.0.1:{port}/bot"
+        update_ids = iter(range(1, 1 << 62))
+        for _ in range(200):
+            try:
+                session.post(url, json={"update_id": 0})
+                break
+            except http.ConnectionError:
+                time.sleep(0.1)
+        lock = threading.Lock()
+
+        def deliver(update):
+            with lock:
+                update["update_id"] = next(update_ids)
+            session.post(url, json=update, timeout=10)
+    else:
+        deliver = server.push_update
+
+    latencies = {}
+    timeouts = {}
+    results_lock = threading.Lock()
+
+    def drive(user):
+        for _ in range(args.sessions):
+            for name, build, predicate in SCENARIOS[user.scenario]:
+                user.done.clear()
+                user.predicate = predicate
+                started = time.perf_counter()
+                deliver(build(user))
+                ok = user.done.wait(args.step_timeout)
+                elapsed = time.perf_counter() - started
+                with results_lock:
+                    if ok:
+                        latencies.setdefault(name, []).append(elapsed)
+                    else:
+                        timeouts[name] = timeouts.get(name, 0) + 1
+                if not ok:
+                    # Ответ потерян (ошибка API) — начинаем сессию заново
+                    user.predicate = None
+                    break
+                if args.think:
+                    time.sleep(random.uniform(0, 2 * args.think))
+
+    rss_samples = []
+    sampling = threading.Event()
+
+    def sample_rss():
+        while not sampling.is_set():
+            rss_samples.append(rss_mb(bot.pid))
+            sampling.wait(0.25)
+
+    # Ждём, пока бот поднимется: первый /start первого пользователя
+    warmup = users[1]
+    warmup.predicate = menu_shown
+    warmup_started = time.perf_counter()
+    deliver(message_update(1, "/start"))
+    if not warmup.done.wait(60):
+        bot.kill()
+        raise SystemExit("бот не ответил за 60 с")
+    startup = time.perf_counter() - warmup_started
+    rss_start = rss_mb(bot.pid)
+
+    threading.Thread(target=sample_rss, daemon=True).start()
+    calls_before = len(server.calls)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=drive, args=(user,), daemon=True) for user in users.values()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    sampling.set()
+    rss_end = rss_mb(bot.pid)
+    size_after = db_size(workdir)
+
+    bot.terminate()
+    try:
+        bot.wait(10)
+    except subprocess.TimeoutExpired:
+        bot.kill()
+    server.stop()
+
+    calls = {}
+    for _, method, _ in server.calls[calls_before:]:
+        if method != "getUpdates":
+            calls[method] = calls.get(method, 0) + 1
+    steps = sum(len(values) for values in latencies.values())
+    report = {
+        "mode": args.mode,
+        "users": args.users,
+        "mix": weights,
+        "elapsed s": elapsed,
+        "steps": steps,
+        "steps/s": steps / elapsed if elapsed else 0.0,
+        "startup s": startup,
+        "latency ms": {
+            name: {
+                "n": len(values),
+                "p50": percentile(sorted(values), 0.50) * 1000,
+                "p90": percentile(sorted(values), 0.90) * 1000,
+                "p99": percentile(sorted(values), 0.99) * 1000,
+                "max": max(values) * 1000,
+            }
+            for name, values in sorted(latencies.items())
+        },
+        "timeouts": timeouts,
+        "injected errors": server.injected,
+        "api calls": calls,
+        "db MB": {"before": size_before / 2**20, "after": size_after / 2**20},
+        "rss MB": {"start": rss_start, "peak": max(rss_samples or [rss_end]), "end": rss_end},
+    }
+    return report
+
+
+def print_report(report):
+    print(f"mode={report['mode']} users={report['users']} mix={report['mix']}")
+    print(f"startup {report['startup s']:.2f}s, {report['steps']} steps in {report['elapsed s']:.1f}s "
+          f"= {report['steps/s']:.1f} steps/s")
+    print(f"{'step':<10}{'n':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in report["latency ms"].items():
+        print(f"{name:<10}{stats['n']:>7}{stats['p50']:>10.1f}{stats['p90']:>10.1f}{stats['p99']:>10.1f}{stats['max']:>10.1f}")
+    print(f"timeouts: {report['timeouts'] or 0}; injected errors: {report['injected errors'] or 0}")
+    print(f"api calls: {report['api calls']}")
+    db_mb, rss = report["db MB"], report["rss MB"]
+    print(f"db: {db_mb['before']:.2f} -> {db_mb['after']:.2f} MB; "
+          f"rss: start {rss['start']:.1f}, peak {rss['peak']:.1f}, end {rss['end']:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=5, help="повторов сценария на пользователя")
+    parser.add_argument("--mix", default="reader=5,historian=3,deleter=2", help="доли сценариев")
+    parser.add_argument("--history-days", type=int, default=730, help="глубина истории при заполнении базы")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка фейкового API, с")
+    parser.add_argument("--faults", default="", help="код:доля через запятую, например 429:0.01,403:0.002")
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза между шагами, с")
+    parser.add_argument("--step-timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
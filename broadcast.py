@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import db
+import metrics
+
+# === РАССЫЛКА С ОГРАНИЧЕНИЕМ СКОРОСТИ ===
+# Очередь рассылки хранится в базе: при падении процесса run() продолжит
+# с тех получателей, которым ещё ничего не отправлено. Получателей процесс сначала
+# забирает себе (CLAIMED) одной транзакцией — несколько процессов бота на одной базе
+# делят рассылку, а не повторяют её. Забранные упавшим процессом строки через
+# CLAIM_TIMEOUT секунд снова становятся ожидающими.
+
+PENDING, SENT, FAILED, CLAIMED = 0, 1, 2, 3
+BATCH_SIZE = 100  # столько забирается за раз: ~4 с при 25 сообщениях в секунду
+CLAIM_TIMEOUT = 120
+CLAIM_POLL = 1.0  # пока чужие забранные строки не отправлены или не просрочены
+STATUS_BATCH = 25  # статусы пишутся по мере отправки: после падения повторно уйдут не больше этого
+
+
+class RetryAfter(Exception):
+    def __init__(self, seconds):
+        super().__init__(f"retry after {seconds}s")
+        self.seconds = seconds
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # 429 от Telegram: останавливаем всех отправителей, а не только получивший ответ поток
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._updated = self._paused_until
+            self._tokens = 0
+
+
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_runs (
+            run_id TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            duration REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS send_queue (
+            run_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            text TEXT,
+            status INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_at REAL,
+            PRIMARY KEY (run_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_send_queue_pending ON send_queue (run_id, user_id) WHERE status = 0")
+    # Индекс забранных строк (run_id, claimed_at) WHERE status = 3 создаёт миграция v6
+    # в meter.py: в старых базах к этому моменту ещё нет колонки claimed_at
+
+def prune(finished_before):
+    # Очередь завершённой рассылки нужна только для докачки после падения.
+    # Строка broadcast_runs остаётся: по ней видна статистика запуска
+    return db.execute(
+        "DELETE FROM send_queue WHERE run_id IN (SELECT run_id FROM broadcast_runs WHERE finished_at < ?)",
+        (finished_before,)
+    )
+
+
+class Broadcaster:
+    # send(user_id, text, reply_markup) -> результат или None при постоянной ошибке;
+    # при 429 должен бросать RetryAfter
+    def __init__(self, send, rate=25.0, workers=8, max_attempts=3):
+        self.send = send
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._running = set()
+        self._lock = threading.Lock()
+        # Один пул на все запуски: потоки (а с ними их соединения с базой, которые открывает
+        # _deactivate_user при 403/400) живут с процессом, а не копятся с каждой рассылкой
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="broadcast")
+
+    def enqueue(self, run_id, recipients, text, reply_markup=None):
+        # recipients — user_id или пары (user_id, персональный текст)
+        items = [(run_id, r, None) if isinstance(r, int) else (run_id, r[0], r[1]) for r in recipients]
+        with db.transaction() as cursor:
+            cursor.execute(
+                "INSERT OR IGNORE INTO broadcast_runs (run_id, text, reply_markup, created_at) VALUES (?, ?, ?, ?)",
+                (run_id, text, reply_markup, time.time())
+            )
+            cursor.executemany("INSERT OR IGNORE INTO send_queue (run_id, user_id, text) VALUES (?, ?, ?)", items)
+            cursor.execute("UPDATE broadcast_runs SET finished_at = NULL WHERE run_id = ?", (run_id,))
+        return len(items)
+
+    def _deliver(self, item, default_text, reply_markup):
+        user_id, text = item
+        attempts = 0
+        while attempts < self.max_attempts:
+            attempts += 1
+            self.bucket.acquire()
+            try:
+                result = self.send(user_id, text or default_text, reply_markup)
+            except RetryAfter as e:
+                logging.warning("Flood control during broadcast, pausing %ss.", e.seconds)
+                metrics.BROADCAST_FLOOD_WAITS.inc()
+                self.bucket.pause(e.seconds)
+                continue
+            except Exception as e:
+                logging.error("Broadcast send to %s failed: %s", user_id, e)
+                return FAILED, attempts, user_id
+            return (SENT if result is not None else FAILED), attempts, user_id
+        return FAILED, attempts, user_id
+
+    def _claim(self, run_id):
+        # Пачка получателей этому процессу или [] — тогда claimed_at самой старой чужой
+        # незавершённой пачки (None — рассылка закончена)
+        now = time.time()
+        with db.transaction() as cursor:
+            cursor.execute(
+                "UPDATE send_queue SET status = 0 WHERE run_id = ? AND status = 3 AND claimed_at < ?",
+                (run_id, now - CLAIM_TIMEOUT)
+            )
+            cursor.execute('''
+                UPDATE send_queue SET status = 3, claimed_at = ?
+                WHERE run_id = ? AND user_id IN (
+                    SELECT user_id FROM send_queue WHERE run_id = ? AND status = 0 ORDER BY user_id LIMIT ?
+                )
+                RETURNING user_id, text
+            ''', (now, run_id, run_id, BATCH_SIZE))
+            batch = cursor.fetchall()
+            if batch:
+                return batch, None
+            cursor.execute("SELECT MIN(claimed_at) FROM send_queue WHERE run_id = ? AND status = 3", (run_id,))
+            return [], cursor.fetchone()[0]
+
+    def _record(self, run_id, kind, results):
+        db.executemany(
+            "UPDATE send_queue SET status = ?, attempts = attempts + ? WHERE run_id = ? AND user_id = ?",
+            [(status, attempts, run_id, user_id) for status, attempts, user_id in results]
+        )
+        batch_sent = sum(1 for status, _, _ in results if status == SENT)
+        metrics.BROADCAST_MESSAGES.inc(batch_sent, kind=kind, status="sent")
+        metrics.BROADCAST_MESSAGES.inc(len(results) - batch_sent, kind=kind, status="failed")
+        return batch_sent
+
+    def run(self, run_id):
+        with self._lock:
+            if run_id in self._running:
+                logging.info("Broadcast %s is already running.", run_id)
+                return None
+            self._running.add(run_id)
+        try:
+            return self._run(run_id)
+        finally:
+            with self._lock:
+                self._running.discard(run_id)
+
+    def _run(self, run_id):
+        row = db.fetchone("SELECT text, reply_markup FROM broadcast_runs WHERE run_id = ?", (run_id,))
+        if row is None:
+            return None
+        default_text, reply_markup = row
+
+        kind = run_id.split(":", 1)[0]
+        started = time.monotonic()
+        sent = failed = 0
+        while True:
+            batch, claimed_elsewhere = self._claim(run_id)
+            if not batch:
+                if claimed_elsewhere is None:
+                    break
+                # Остаток у другого процесса: ждём, пока он допишет статусы или пачка просрочится
+                time.sleep(CLAIM_POLL)
+                continue
+            futures = [self._pool.submit(self._deliver, item, default_text, reply_markup) for item in batch]
+            pending, results = len(futures), []
+            for future in as_completed(futures):
+                results.append(future.result())
+                pending -= 1
+                if len(results) >= STATUS_BATCH or not pending:
+                    batch_sent = self._record(run_id, kind, results)
+                    sent += batch_sent
+                    failed += len(results) - batch_sent
+                    results = []
+
+        duration = time.monotonic() - started
+        db.execute(
+            "UPDATE broadcast_runs SET finished_at = ?, sent = sent + ?, failed = failed + ?, duration = duration + ? WHERE run_id = ?",
+            (time.time(), sent, failed, duration, run_id)
+        )
+        stats = {
+            "run_id": run_id,
+            "sent": sent,
+            "failed": failed,
+            "duration": duration,
+            "rate": (sent + failed) / duration if duration > 0 else 0.0,
+        }
+        metrics.BROADCAST_RATE.set(stats["rate"], kind=kind)
+        logging.info("Broadcast %s finished: %s sent, %s failed in %.1fs (%.1f msg/s).",
+                     run_id, sent, failed, duration, stats["rate"], extra={"duration": round(duration, 3)})
+        return stats
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def resume_pending(self):
+        for (run_id,) in db.fetchall("SELECT run_id FROM broadcast_runs WHERE finished_at IS NULL ORDER BY created_at"):
+            logging.info("Resuming interrupted broadcast %s.", run_id)
+            self.run(run_id)
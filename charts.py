@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import db
+import readings
+
+# === ГРАФИКИ ПОТРЕБЛЕНИЯ ===
+# PNG кэшируется на диске под ключом sha256(счётчик, версия показаний),
+# так что любое изменение показаний даёт новый ключ, а старый файл вытесняется по LRU.
+# После первой отправки Telegram возвращает file_id — повторно картинка не загружается.
+
+CHART_DIR = os.getenv("CHART_CACHE_DIR", "charts")
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_MB", "50")) * 1024 * 1024
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "1"))
+CHART_MONTHS = 24
+
+_pool = None
+_pool_lock = threading.Lock()
+_evict_lock = threading.Lock()
+
+
+def create_tables(cursor):
+    # Один file_id на счётчик: устаревший ключ просто перезаписывается
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chart_files (
+            meter_id INTEGER PRIMARY KEY,
+            key TEXT NOT NULL,
+            file_id TEXT NOT NULL
+        )
+    ''')
+
+
+def cache_key(meter_id, version):
+    return hashlib.sha256(f"{meter_id}:{version[0]}:{version[1]}".encode()).hexdigest()
+
+def _path(key):
+    return os.path.join(CHART_DIR, key + ".png")
+
+def _cached_file_id(meter_id, key):
+    row = db.fetchone("SELECT key, file_id FROM chart_files WHERE meter_id = ?", (meter_id,))
+    return row[1] if row and row[0] == key else None
+
+def remember(meter_id, key, file_id):
+    db.execute("INSERT OR REPLACE INTO chart_files (meter_id, key, file_id) VALUES (?, ?, ?)", (meter_id, key, file_id))
+
+def forget(meter_id):
+    db.execute("DELETE FROM chart_files WHERE meter_id = ?", (meter_id,))
+
+
+# === КЭШ PNG НА ДИСКЕ (LRU ПО mtime) ===
+def _touch(path):
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def evict(limit=None):
+    limit = CHART_CACHE_BYTES if limit is None else limit
+    with _evict_lock:
+        files = []
+        for entry in os.scandir(CHART_DIR):
+            if entry.name.endswith(".png"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+    return removed
+
+
+# === ОТРИСОВКА (В ПРОЦЕССЕ-ИСПОЛНИТЕЛЕ) ===
+def render_png(path, title, unit, months, consumption):
+    # matplotlib (~0,5 с и ~40 МБ) импортируется только в процессе-исполнителе при
+    # первой отрисовке — процессу бота он не нужен
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+
+    labels = [f"{month[5:7]}.{month[2:4]}" for month in months]
+    fig = Figure(figsize=(8, 4), dpi=100)
+    ax = fig.subplots()
+    ax.bar(range(len(consumption)), consumption, color="#4a90d9")
+    step = -(-len(labels) // 8) or 1  # не больше 8 подписей
+    ax.set_xticks(range(0, len(labels), step), labels[::step])
+    ax.set_title(title)
+    ax.set_ylabel(unit)
+    ax.grid(axis="y", alpha=0.3)
+    fig.tight_layout()
+    # Пишем во временный файл и переименовываем — другой поток не увидит недописанный PNG
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fig.savefig(tmp, format="png")
+    os.replace(tmp, path)
+    return path
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver: fork копировал бы процесс бота с его потоками и замками — пул
+            # создаётся лениво, когда они уже запущены. Исполнитель импортирует главный
+            # модуль (meter.py как __mp_main__) — это безопасно: бот, планировщик и фоновые
+            # задачи запускаются только в create_app() под if __name__ == '__main__'
+            _pool = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+        return _pool
+
+def shutdown():
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+
+
+# === ВЫДАЧА ГРАФИКА ===
+def send_chart(meter_id, title, unit, send, submit):
+    # send(photo) -> file_id или None; photo — file_id или открытый PNG.
+    # submit(fn, *args) ставит fn в очередь чата (client.Outbox.call): отправка не обгонит
+    # ответы, поставленные раньше, и не занимает ни обработчик, ни поток пула процессов.
+    # Возвращает False, если для графика мало показаний. Отрисовка идёт в пуле процессов,
+    # отправка — по её завершении, так что обработчик не ждёт matplotlib.
+    version = readings.version(meter_id)
+    if version[1] < 2:
+        return False
+    key = cache_key(meter_id, version)
+    path = _path(key)
+
+    def render():
+        totals = readings.monthly_totals(meter_id)[-CHART_MONTHS:]
+        months = [month for month, _ in totals]
+        consumption = [value for _, value in totals]
+        os.makedirs(CHART_DIR, exist_ok=True)
+        future = _get_pool().submit(render_png, path, title, unit, months, consumption)
+
+        def done(future):
+            # Поток управления пулом только передаёт готовый файл в очередь чата
+            try:
+                submit(send_photo, None, future.result(), True)
+            except Exception as e:
+                logging.error("Chart for meter %s failed: %s", meter_id, e)
+
+        future.add_done_callback(done)
+
+    def send_photo(file_id, png, rendered=False):
+        # Выполняется в очереди чата; имя функции — метка метрики отправки в client.Outbox
+        try:
+            if file_id is not None:
+                if send(file_id) is not None:
+                    return
+                forget(meter_id)
+                if not _touch(png):
+                    render()
+                    return
+            with open(png, "rb") as photo:
+                new_file_id = send(photo)
+            if new_file_id is not None:
+                remember(meter_id, key, new_file_id)
+            if rendered:
+                evict()
+        except Exception as e:
+            logging.error("Chart for meter %s failed: %s", meter_id, e)
+
+    file_id = _cached_file_id(meter_id, key)
+    if file_id is not None or _touch(path):
+        submit(send_photo, file_id, path)
+    else:
+        render()
+    return True
@@ -0,0 +1,167 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+import telebot
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# === КЛИЕНТ BOT API: ОЧЕРЕДЬ ИСХОДЯЩИХ ПО ЧАТАМ ===
+# Обработчик не ждёт Telegram: сообщения и правки ставятся в очередь своего чата
+# и отправляются фоновыми потоками строго по порядку. Если к моменту отправки в
+# очереди чата скопилось несколько текстов подряд, они склеиваются в одно
+# сообщение (клавиатура — от последнего), так что цепочка ответов стоит один запрос.
+
+MAX_MESSAGE_LENGTH = 4096
+FOLD_SEPARATOR = "\n\n"
+
+
+def keep_alive_session(pool_size):
+    # Одна сессия requests на все потоки telebot: соединения с api.telegram.org
+    # переиспользуются, пул не меньше числа отправляющих потоков
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    telebot.apihelper.session = session
+    return session
+
+
+def _tg_len(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _is_inline(markup):
+    if markup is None:
+        return False
+    if isinstance(markup, str):
+        return '"inline_keyboard"' in markup
+    return isinstance(markup, telebot.types.InlineKeyboardMarkup)
+
+
+class _Text:
+    __slots__ = ("text", "parse_mode", "reply_markup", "futures")
+
+    def __init__(self, text, parse_mode, reply_markup, future):
+        self.text = text
+        self.parse_mode = parse_mode
+        self.reply_markup = reply_markup
+        self.futures = [future]
+
+    def absorbs(self, other):
+        # Клавиатура привязана к своему сообщению, поэтому склеиваем только
+        # если у текущего её нет. Inline-кнопки правят своё сообщение (◀/▶, подтверждение
+        # удаления) — сообщение с ними не склеивается, чтобы правка не стёрла чужой текст
+        return (isinstance(other, _Text) and self.reply_markup is None
+                and not _is_inline(other.reply_markup)
+                and self.parse_mode == other.parse_mode
+                and _tg_len(self.text) + len(FOLD_SEPARATOR) + _tg_len(other.text) <= MAX_MESSAGE_LENGTH)
+
+    def absorb(self, other):
+        self.text += FOLD_SEPARATOR + other.text
+        self.reply_markup = other.reply_markup
+        self.futures.extend(other.futures)
+
+
+class _Call:
+    __slots__ = ("fn", "args", "kwargs", "future")
+
+    def __init__(self, fn, args, kwargs, future):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+
+
+def fold(items):
+    folded = []
+    for item in items:
+        if folded and isinstance(folded[-1], _Text) and folded[-1].absorbs(item):
+            folded[-1].absorb(item)
+        else:
+            folded.append(item)
+    return folded
+
+
+class Outbox:
+    def __init__(self, bot, workers=8):
+        self.bot = bot
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox")
+
+    def send(self, chat_id, text, parse_mode=None, reply_markup=None):
+        future = Future()
+        self._put(chat_id, _Text(text, parse_mode, reply_markup, future))
+        return future
+
+    def call(self, chat_id, fn, *args, **kwargs):
+        # Любой другой вызов API (правка, удаление) в общем порядке сообщений чата
+        future = Future()
+        self._put(chat_id, _Call(fn, args, kwargs, future))
+        return future
+
+    def _put(self, chat_id, item):
+        with self._lock:
+            queue = self._queues.get(chat_id)
+            if queue is not None:
+                queue.append(item)
+                return
+            queue = self._queues[chat_id] = collections.deque([item])
+        try:
+            self._executor.submit(self._drain, chat_id, queue)
+        except RuntimeError:
+            # Интерпретатор завершается (ThreadPoolExecutor уже не принимает задачи), а
+            # задача планировщика ещё досылает ответы — отправляем в вызывающем потоке
+            self._drain(chat_id, queue)
+
+    def _drain(self, chat_id, queue):
+        while True:
+            with self._lock:
+                if not queue:
+                    del self._queues[chat_id]
+                    return
+                batch = list(queue)
+                queue.clear()
+            for item in fold(batch):
+                if isinstance(item, _Text):
+                    self._send_text(chat_id, item)
+                else:
+                    self._call(item)
+
+    def _send_text(self, chat_id, item):
+        started = time.perf_counter()
+        try:
+            result = self.bot.send_message(chat_id, item.text, parse_mode=item.parse_mode, reply_markup=item.reply_markup)
+        except Exception as e:
+            _count_error("send_message", e)
+            for future in item.futures:
+                future.set_exception(e)
+        else:
+            for future in item.futures:
+                future.set_result(result)
+        finally:
+            metrics.TELEGRAM_SECONDS.observe(time.perf_counter() - started, method="send_message")
+
+    def _call(self, item):
+        name = getattr(item.fn, "__name__", "call")
+        started = time.perf_counter()
+        try:
+            item.future.set_result(item.fn(*item.args, **item.kwargs))
+        except Exception as e:
+            _count_error(name, e)
+            item.future.set_exception(e)
+        finally:
+            metrics.TELEGRAM_SECONDS.observe(time.perf_counter() - started, method=name)
+
+    def close(self):
+        # Дожидаемся отправки всего, что уже в очереди
+        self._executor.shutdown(wait=True)
+
+
+def _count_error(method, e):
+    code = e.error_code if isinstance(e, telebot.apihelper.ApiTelegramException) else "network"
+    metrics.TELEGRAM_ERRORS.inc(method=method, code=code)
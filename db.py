@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+import logging
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# === НАСТРОЙКИ БАЗЫ ===
+DB_PATH = "my_meter.db"
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 10000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_write_lock = threading.RLock()
+
+
+# === ПУЛ СОЕДИНЕНИЙ (ПО ОДНОМУ НА ПОТОК) ===
+def connect(path=None):
+    # isolation_level=None: чтение идёт без открытой транзакции,
+    # запись — только через transaction() с BEGIN IMMEDIATE
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=10.0,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = connect()
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def close_all():
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+    _local.__dict__.clear()
+    logging.info("Database connections closed.")
+
+
+# === ЧТЕНИЕ ===
+def fetchone(sql, params=()):
+    with metrics.DB_SECONDS.time(op="fetchone"):
+        return get_conn().execute(sql, params).fetchone()
+
+def fetchall(sql, params=()):
+    with metrics.DB_SECONDS.time(op="fetchall"):
+        return get_conn().execute(sql, params).fetchall()
+
+def iterate(sql, params=(), batch_size=500):
+    # Построчная выдача без загрузки всего результата в память;
+    # в метрику попадает только выполнение запроса до первой пачки
+    with metrics.DB_SECONDS.time(op="iterate"):
+        cursor = get_conn().execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+# === ЕДИНСТВЕННЫЙ ПУТЬ ЗАПИСИ ===
+@contextmanager
+def transaction():
+    conn = get_conn()
+    waited = time.perf_counter()
+    with _write_lock:
+        if conn.in_transaction:
+            # Вложенный вызов — продолжаем внешнюю транзакцию
+            yield conn.cursor()
+            return
+        started = time.perf_counter()
+        metrics.DB_LOCK_WAIT_SECONDS.observe(started - waited)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        metrics.DB_SECONDS.observe(time.perf_counter() - started, op="transaction")
+
+def execute_exclusive(sql):
+    # VACUUM и чекпоинт не выполняются внутри транзакции: запускаем вне её,
+    # но под замком записи, чтобы потоки бота не начали запись посередине
+    with _write_lock:
+        with metrics.DB_SECONDS.time(op="exclusive"):
+            return get_conn().execute(sql).fetchall()
+
+def execute(sql, params=()):
+    with transaction() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+def executemany(sql, seq_of_params):
+    with transaction() as cursor:
+        cursor.executemany(sql, seq_of_params)
+        return cursor.rowcount
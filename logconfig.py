@@ -0,0 +1,185 @@
+import atexit
+import contextvars
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+# === ЛОГИРОВАНИЕ ===
+# Потоки бота только кладут запись в очередь (QueueHandler); форматирование в JSON,
+# запись в файл и ротация со сжатием идут в отдельном потоке QueueListener.
+# Повторяющиеся предупреждения и ошибки (например, тысячи «blocked the bot» во время
+# рассылки) ограничиваются по шаблону сообщения ещё до постановки в очередь.
+
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_MB", "10")) * 1024 * 1024
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")  # например, midnight — ротация по времени
+LOG_QUEUE_SIZE = 10000
+TEXT_FORMAT = '%(asctime)s | %(levelname)s | %(message)s'
+
+# Поля, которые попадают в JSON, если заданы в extra= или контексте обработчика
+CONTEXT_FIELDS = ("user_id", "handler", "duration", "suppressed")
+
+_context = contextvars.ContextVar("log_context", default={})
+_listener = None
+
+
+# === КОНТЕКСТ ОБРАБОТЧИКА ===
+@contextmanager
+def context(**fields):
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        for name, value in _context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+# === ОГРАНИЧЕНИЕ ПОВТОРОВ ===
+class RateLimitFilter(logging.Filter):
+    # Не больше burst записей с одним шаблоном за interval секунд (для WARNING и выше).
+    # Первая запись следующего окна несёт число пропущенных в поле suppressed.
+    def __init__(self, interval=60.0, burst=5, level=logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.level = level
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+# === СКРЫТИЕ СЕКРЕТОВ ===
+class RedactFilter(logging.Filter):
+    # Токен бота входит в URL Bot API (/bot<TOKEN>/..., /file/bot<TOKEN>/...), а тексты
+    # исключений requests эти URL повторяют. Сообщение и трассировка форматируются
+    # здесь, до очереди, и секреты в них заменяются
+    def __init__(self, secrets):
+        super().__init__()
+        self.secrets = [secret for secret in secrets if secret]
+
+    def _redact(self, text):
+        for secret in self.secrets:
+            text = text.replace(secret, "<redacted>")
+        return text
+
+    def filter(self, record):
+        if not self.secrets:
+            return True
+        record.msg, record.args = self._redact(record.getMessage()), None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = self._redact(record.exc_text)
+        return True
+
+
+# === ФОРМАТ JSON ===
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        # Трассировку QueueHandler.prepare уже дописал в текст сообщения
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", None)
+        return f"{text} (+{suppressed} similar suppressed)" if suppressed else text
+
+
+# === РОТАЦИЯ СО СЖАТИЕМ ===
+def _gzip_namer(name):
+    return name + ".gz"
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+def _file_handler(path):
+    if LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS, encoding="utf-8")
+    else:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Переполненная очередь не должна останавливать обработчики бота
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup(log_file=LOG_FILE, level=LOG_LEVEL, secrets=()):
+    global _listener
+    if _listener is not None:
+        return _listener
+    stream = logging.StreamHandler()
+    stream.setFormatter(TextFormatter(TEXT_FORMAT))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = _DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(RateLimitFilter())  # по шаблону — до того, как RedactFilter его подставит
+    queue_handler.addFilter(RedactFilter(secrets))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, _file_handler(log_file), stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,382 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import broadcast
+import db
+import metrics
+import readings
+
+# === ОБСЛУЖИВАНИЕ БАЗЫ ===
+# Ночной прогон в тихие часы:
+#   1. резервная копия backup API со своего соединения — в режиме WAL это чтение
+#      одного снимка базы, запись ботом при этом не блокируется;
+#   2. давно отключённые пользователи и показания старше ARCHIVE_AFTER_DAYS (целыми
+#      месяцами) переносятся в холодный файл — сжатую gzip базу SQLite в ARCHIVE_DIR.
+#      У счётчика онлайн остаётся последнее архивное показание (опора для расхода
+#      следующего) и все помесячные итоги, так что история и графики не меняются.
+#      Пользователи пишутся в отдельный файл прогона (users-*.db.gz), его и читает /start;
+#   3. освободившиеся страницы возвращаются инкрементальным VACUUM короткими
+#      транзакциями, затем ANALYZE с ограничением analysis_limit.
+# Отчёт прогона (размер базы и задержка типовых запросов до и после) пишется
+# в лог, метрики и таблицу maintenance_runs.
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "1095"))
+INACTIVE_AFTER_DAYS = int(os.getenv("INACTIVE_AFTER_DAYS", "180"))
+BROADCAST_KEEP_DAYS = 90
+CHUNK_METERS = 200
+CHUNK_USERS = 200
+VACUUM_STEP_PAGES = 1000
+VACUUM_PAUSE = 0.05  # между шагами VACUUM успевают пройти записи бота
+ANALYSIS_LIMIT = 1000
+PROBE_METERS = 50
+INCREMENTAL = 2
+GZIP_LEVEL = 6  # почти как 9 по размеру, но в разы быстрее
+
+# Таблицы холодного файла: те же колонки, без индексов и автоинкремента
+COLD_TABLES = {
+    "users": "user_id, active, remind_skipped, deactivated_at",
+    "meters": "meter_id, user_id, resource, name, tariff",
+    "readings": "meter_id, date, value, delta, run_count, run_sum",
+    "monthly_totals": "meter_id, month, consumption, readings",
+    "archive_bounds": "meter_id, before",
+    "tariffs": "user_id, resource, zone, meter_id, valid_from, tiers",
+}
+
+
+def create_tables(cursor):
+    # Где лежат данные архивированного пользователя — по ним /start вернёт историю
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_users (
+            user_id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            report TEXT NOT NULL
+        )
+    ''')
+
+
+# === ХОЛОДНЫЕ ФАЙЛЫ ===
+def _gzip(src, dst):
+    with open(src, "rb") as f_in, gzip.open(dst, "wb", compresslevel=GZIP_LEVEL) as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(src)
+
+class _ColdFile:
+    # База SQLite, которая после записи сжимается в path (.db.gz)
+    def __init__(self, path):
+        self.path = path
+        self._raw = path[:-len(".gz")]
+        self._conn = None
+        self.rows = 0
+
+    def conn(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self._raw)
+            for table, columns in COLD_TABLES.items():
+                self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+        return self._conn
+
+    def copy(self, cursor, table, where, params):
+        # Строки table из основной базы по условию where — в холодный файл
+        columns = COLD_TABLES[table]
+        cursor.execute(f"SELECT {columns} FROM {table} WHERE {where}", params)
+        rows = cursor.fetchall()
+        if rows:
+            placeholders = ", ".join("?" * len(columns.split(",")))
+            self.conn().executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
+            self.rows += len(rows)
+        return len(rows)
+
+    def commit(self):
+        # До удаления из основной базы строки должны лежать на диске
+        if self._conn is not None:
+            self._conn.commit()
+
+    def close(self):
+        if self._conn is None:
+            return None
+        self._conn.commit()
+        self._conn.close()
+        _gzip(self._raw, self.path)
+        return self.path
+
+@contextmanager
+def _open_cold(path):
+    # Своя временная копия на каждое открытие: восстановления могут идти параллельно
+    fd, raw = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(path) or ".")
+    with gzip.open(path, "rb") as f_in, os.fdopen(fd, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    conn = sqlite3.connect(raw)
+    try:
+        yield conn
+    finally:
+        conn.close()
+        os.remove(raw)
+
+
+# === АРХИВ ПОКАЗАНИЙ ===
+def _archive_readings(cold, cutoff):
+    # Счётчики, у которых до границы больше одного показания: последнее остаётся опорой
+    candidates = db.fetchall(
+        "SELECT meter_id, MAX(date) FROM readings WHERE date < ? GROUP BY meter_id HAVING COUNT(*) > 1", (cutoff,)
+    )
+    moved = 0
+    for i in range(0, len(candidates), CHUNK_METERS):
+        chunk = candidates[i:i + CHUNK_METERS]
+        with db.transaction() as cursor:
+            for meter_id, anchor in chunk:
+                moved += cold.copy(cursor, "readings", "meter_id = ? AND date < ?", (meter_id, anchor))
+                cold.copy(cursor, "meters", "meter_id = ?", (meter_id,))
+            cold.commit()
+            cursor.executemany("DELETE FROM readings WHERE meter_id = ? AND date < ?", chunk)
+            cursor.executemany('''
+                INSERT INTO archive_bounds (meter_id, before) VALUES (?, ?)
+                ON CONFLICT (meter_id) DO UPDATE SET before = MAX(before, excluded.before)
+            ''', [(meter_id, cutoff) for meter_id, _ in chunk])
+    return moved
+
+
+# === АРХИВ ПОЛЬЗОВАТЕЛЕЙ ===
+def _archive_users(cold, deactivated_before):
+    user_ids = [row[0] for row in db.fetchall(
+        "SELECT user_id FROM users WHERE active = 0 AND deactivated_at < ?", (deactivated_before,)
+    )]
+    for i in range(0, len(user_ids), CHUNK_USERS):
+        chunk = json.dumps(user_ids[i:i + CHUNK_USERS])
+        users = "user_id IN (SELECT value FROM json_each(?))"
+        meters = f"meter_id IN (SELECT meter_id FROM meters WHERE {users})"
+        with db.transaction() as cursor:
+            for table in ("users", "meters", "tariffs"):
+                cold.copy(cursor, table, users, (chunk,))
+            for table in ("readings", "monthly_totals", "archive_bounds"):
+                cold.copy(cursor, table, meters, (chunk,))
+            cold.commit()
+            for table in ("readings", "monthly_totals", "archive_bounds", "chart_files", "analytics_watermark"):
+                cursor.execute(f"DELETE FROM {table} WHERE {meters}", (chunk,))
+            for table in ("meters", "tariffs", "deferred_reminders", "users"):
+                cursor.execute(f"DELETE FROM {table} WHERE {users}", (chunk,))
+    return user_ids
+
+def _register_archived(path, user_ids):
+    # Только после сжатия: найденная /start запись должна указывать на готовый файл
+    archived_at = datetime.now().strftime("%Y-%m-%d")
+    with db.transaction() as cursor:
+        cursor.executemany(
+            "INSERT OR REPLACE INTO archived_users (user_id, path, archived_at) VALUES (?, ?, ?)",
+            [(user_id, path, archived_at) for user_id in user_ids]
+        )
+
+def restore_user(user_id):
+    # Вернувшемуся пользователю (/start) — счётчики, показания, итоги и цены из архива.
+    # meter_id выдаются заново: старые могли уже занять новые счётчики. Порядок прежний —
+    # по нему строится меню
+    row = db.fetchone("SELECT path FROM archived_users WHERE user_id = ?", (user_id,))
+    if row is None or not os.path.exists(row[0]):
+        return False
+    with _open_cold(row[0]) as cold:
+        user = cold.execute("SELECT remind_skipped FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        meters = cold.execute(
+            "SELECT meter_id, resource, name, tariff FROM meters WHERE user_id = ? ORDER BY meter_id", (user_id,)
+        ).fetchall()
+        data = {}
+        for table in ("readings", "monthly_totals", "archive_bounds"):
+            data[table] = cold.execute(
+                f"SELECT {COLD_TABLES[table]} FROM {table} WHERE meter_id IN "
+                f"(SELECT meter_id FROM meters WHERE user_id = ?)", (user_id,)
+            ).fetchall()
+        prices = cold.execute(
+            "SELECT resource, zone, meter_id, valid_from, tiers FROM tariffs WHERE user_id = ?", (user_id,)
+        ).fetchall()
+
+    with db.transaction() as cursor:
+        cursor.execute(
+            "INSERT OR IGNORE INTO users (user_id, active, remind_skipped) VALUES (?, 1, ?)",
+            (user_id, user[0] if user else 0)
+        )
+        new_ids = {}
+        for meter_id, resource, name, tariff in meters:
+            cursor.execute(
+                "INSERT OR IGNORE INTO meters (user_id, resource, name, tariff) VALUES (?, ?, ?, ?)",
+                (user_id, resource, name, tariff)
+            )
+            cursor.execute("SELECT meter_id FROM meters WHERE user_id = ? AND name = ?", (user_id, name))
+            new_ids[meter_id] = cursor.fetchone()[0]
+        for table, rows in data.items():
+            columns = COLD_TABLES[table]
+            placeholders = ", ".join("?" * len(columns.split(",")))
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO {table} ({columns}) VALUES ({placeholders})",
+                [(new_ids[row[0]],) + row[1:] for row in rows]
+            )
+        cursor.executemany(
+            "INSERT OR IGNORE INTO tariffs (user_id, resource, zone, meter_id, valid_from, tiers) VALUES (?, ?, ?, ?, ?, ?)",
+            [(user_id, resource, zone, new_ids.get(meter_id, 0), valid_from, tiers)
+             for resource, zone, meter_id, valid_from, tiers in prices]
+        )
+        cursor.execute("DELETE FROM archived_users WHERE user_id = ?", (user_id,))
+    logging.info("User %s restored from archive.", user_id, extra={"user_id": user_id})
+    return True
+
+
+# === РЕЗЕРВНАЯ КОПИЯ ===
+def backup():
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    raw = os.path.join(BACKUP_DIR, f"meter-{datetime.now():%Y%m%d-%H%M%S}.db")
+    source = db.connect()
+    target = sqlite3.connect(raw)
+    try:
+        # Одним шагом: по шагам копия начиналась бы заново после каждой записи бота,
+        # а один шаг в режиме WAL — одна читающая транзакция, писатели не ждут
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    path = raw + ".gz"
+    _gzip(raw, path)
+    for old in sorted(glob.glob(os.path.join(BACKUP_DIR, "meter-*.db.gz")))[:-BACKUP_KEEP]:
+        os.remove(old)
+    return path
+
+
+# === VACUUM И СТАТИСТИКА ===
+def _vacuum():
+    # Возвращает число освобождённых страниц
+    if db.fetchone("PRAGMA auto_vacuum")[0] != INCREMENTAL:
+        # Однократно: режим auto_vacuum меняется только полным VACUUM, который
+        # блокирует запись на время прогона, — поэтому он здесь, в тихие часы
+        free = db.fetchone("PRAGMA freelist_count")[0]
+        db.execute_exclusive("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute_exclusive("VACUUM")
+        logging.info("Database switched to incremental auto_vacuum.")
+        return free
+    freed = 0
+    free = db.fetchone("PRAGMA freelist_count")[0]
+    while free:
+        with db.transaction() as cursor:
+            cursor.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall()
+        left = db.fetchone("PRAGMA freelist_count")[0]
+        if left >= free:
+            break
+        freed += free - left
+        free = left
+        time.sleep(VACUUM_PAUSE)
+    return freed
+
+def _analyze():
+    # analysis_limit: ANALYZE читает выборку каждого индекса, а не весь индекс
+    db.execute_exclusive(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    db.execute_exclusive("ANALYZE")
+
+def _db_bytes():
+    # Файл базы вместе с WAL — столько занимает база на диске
+    return sum(os.path.getsize(path) for path in (db.DB_PATH, db.DB_PATH + "-wal") if os.path.exists(path))
+
+
+# === ЗАМЕР ТИПОВЫХ ЗАПРОСОВ ===
+PROBES = (
+    ("latest", readings.latest_reading),
+    ("history", lambda meter_id: readings.history_page(meter_id, 20)),
+    ("totals", readings.monthly_totals),
+)
+
+def _probe_meters():
+    # Случайные счётчики активных пользователей: они переживут прогон, замер до и после сравним
+    max_id = db.fetchone("SELECT MAX(meter_id) FROM meters")[0] or 0
+    sample = random.sample(range(1, max_id + 1), min(max_id, PROBE_METERS * 4))
+    rows = db.fetchall('''
+        SELECT m.meter_id FROM meters m JOIN users u ON u.user_id = m.user_id AND u.active = 1
+        WHERE m.meter_id IN (SELECT value FROM json_each(?))
+        LIMIT ?
+    ''', (json.dumps(sample), PROBE_METERS))
+    return [row[0] for row in rows]
+
+def _probe(meter_ids):
+    # Медиана по выборке, мс; первый проход прогревает кэш страниц
+    result = {}
+    for name, query in PROBES:
+        timings = []
+        for meter_id in meter_ids:
+            query(meter_id)
+            started = time.perf_counter()
+            query(meter_id)
+            timings.append(time.perf_counter() - started)
+        result[name] = round(statistics.median(timings) * 1000, 3) if timings else None
+    return result
+
+
+# === ПРОГОН ===
+def run(now=None):
+    now = now or datetime.now()
+    started = time.perf_counter()
+    report = {"started_at": now.strftime("%Y-%m-%d %H:%M:%S")}
+    steps = {}
+
+    def step(name, func, *args):
+        step_started = time.perf_counter()
+        result = func(*args)
+        steps[name] = round(time.perf_counter() - step_started, 3)
+        metrics.MAINTENANCE_SECONDS.set(steps[name], step=name)
+        return result
+
+    meter_ids = _probe_meters()
+    report["bytes_before"] = _db_bytes()
+    report["latency_ms_before"] = _probe(meter_ids)
+
+    report["backup"] = step("backup", backup)
+
+    # Граница архива — начало месяца, чтобы итоги месяца не делились между архивом и онлайном
+    cutoff = (now - timedelta(days=ARCHIVE_AFTER_DAYS)).strftime("%Y-%m-01")
+    # Пользователи — в свой небольшой файл: /start распаковывает его целиком, и массив
+    # архивных показаний для этого читать не нужно
+    users_cold = _ColdFile(os.path.join(ARCHIVE_DIR, f"users-{now:%Y%m%d-%H%M%S}.db.gz"))
+    archived_users = step(
+        "archive_users", _archive_users, users_cold, (now - timedelta(days=INACTIVE_AFTER_DAYS)).strftime("%Y-%m-%d")
+    )
+    report["users_archived"] = len(archived_users)
+    report["users_archive"] = users_cold.close()
+    if archived_users:
+        _register_archived(report["users_archive"], archived_users)
+    cold = _ColdFile(os.path.join(ARCHIVE_DIR, f"cold-{now:%Y%m%d-%H%M%S}.db.gz"))
+    report["readings_archived"] = step("archive_readings", _archive_readings, cold, cutoff)
+    report["archive"] = cold.close()
+    report["broadcast_rows_pruned"] = broadcast.prune(time.time() - BROADCAST_KEEP_DAYS * 86400)
+
+    report["pages_freed"] = step("vacuum", _vacuum)
+    step("analyze", _analyze)
+    # Освобождённое место уходит из файла только после чекпоинта WAL
+    step("checkpoint", db.execute_exclusive, "PRAGMA wal_checkpoint(TRUNCATE)")
+
+    report["bytes_after"] = _db_bytes()
+    report["latency_ms_after"] = _probe(meter_ids)
+    report["steps"] = steps
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    metrics.DB_SIZE_BYTES.set(report["bytes_after"])
+    metrics.MAINTENANCE_SECONDS.set(report["seconds"], step="total")
+    db.execute("INSERT INTO maintenance_runs (started_at, report) VALUES (?, ?)",
+               (report["started_at"], json.dumps(report)))
+    logging.info("Maintenance finished: %s -> %s bytes, %s readings and %s users archived; latency %s -> %s ms.",
+                 report["bytes_before"], report["bytes_after"], report["readings_archived"],
+                 report["users_archived"], report["latency_ms_before"], report["latency_ms_after"],
+                 extra={"duration": report["seconds"]})
+    return report
@@ -1,12 +1,32 @@
-import sqlite3
 import telebot
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
 from pytz import timezone
 import atexit
+import functools
+import math
+import socket
+import threading
 import time
 import logging
-import re
+import tempfile
+
+import requests
+
+import broadcast
+import charts
+import client
+import db
+import logconfig
+import maintenance
+import metrics
+import nightly
+import readings
+import reminders
+import render
+import state
+import tariffs
+import transfer
 
 from dotenv import load_dotenv
 import os
@@ -17,39 +37,32 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в .env файле!")
 
-
-# === ФУНКЦИЯ ЭКРАНИРОВАНИЯ ДЛЯ MARKDOWNV2 ===
-def escape_markdown_v2(text):
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    return re.sub(r'([%s])' % re.escape(escape_chars), r'\\\1', text)
-
-# === ЛОГГИРОВАНИЕ ===
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
-
 # === НАСТРОЙКИ ===
+# Импорт модуля только создаёт бота (без запросов к API) и регистрирует обработчики:
+# база, логи, соединения и планировщик поднимаются в create_app() (см. «ЗАПУСК»)
 bot = telebot.TeleBot(BOT_TOKEN)
 
-# === ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ ===
-active_users = set()
-remind_skipped = {}
-last_deleted = {}  # {user_id: (table, date, meter, deleted_at)}
+# === СОСТОЯНИЕ ДИАЛОГОВ ===
+# Общее для всех процессов бота и переживает перезапуск (см. state.py)
+state_store = state.create_store(os.getenv("STATE_BACKEND", "sqlite"))
+INPUT_TTL = 3600  # сколько ждём ввод показаний после выбора ресурса
+UNDO_TTL = 300  # окно для /undo — 5 минут
 
 # === КОНФИГУРАЦИЯ РЕСУРСОВ ===
+# Виды ресурсов; счётчики пользователя (горячая и холодная вода, день и ночь
+# у электричества, несколько квартир) — строки таблицы meters, см. readings.py
 RESOURCES = {
-    "⚡ Электричество": {"table": "electricity", "unit": "кВт·ч"},
-    "💧 Вода": {"table": "water", "unit": "м³"},
-    "🔥 Газ": {"table": "gas", "unit": "м³"}
+    "electricity": {"icon": "⚡", "name": "Электричество", "unit": "кВт·ч"},
+    "water": {"icon": "💧", "name": "Вода", "unit": "м³"},
+    "gas": {"icon": "🔥", "name": "Газ", "unit": "м³"}
 }
 
-TABLE_TO_DISPLAY = {v["table"]: k for k, v in RESOURCES.items()}
-ALLOWED_TABLES = {v["table"] for v in RESOURCES.values()}
+# Счётчики, которые заводятся каждому пользователю
+DEFAULT_METERS = [(resource, config["name"]) for resource, config in RESOURCES.items()]
+
+TARIFF_ZONES = {"день": "day", "ночь": "night"}
+MAX_METER_NAME = 32
+MAX_IMPORT_NEW_METERS = 5  # опечатка в столбце названий не должна завалить меню счётчиками
 
 # === СИНОНИМЫ РЕСУРСОВ ===
 RESOURCE_ALIASES = {
@@ -60,21 +73,121 @@ RESOURCE_ALIASES = {
 }
 
 # === РАБОТА С БАЗОЙ ===
-def get_db():
-    return sqlite3.connect("my_meter.db", timeout=10.0)
+def _legacy_owner_id(cursor):
+    # До версии 1 показания не были привязаны к пользователю
+    owner_id = os.getenv("OWNER_ID")
+    if owner_id:
+        return int(owner_id)
+    cursor.execute("SELECT user_id FROM users")
+    rows = cursor.fetchall()
+    if len(rows) == 1:
+        return rows[0][0]
+    logging.warning("Не удалось определить владельца старых показаний (задайте OWNER_ID), используется 0.")
+    return 0
+
+def _columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cursor.fetchall()}
+
+# До версии 3 у каждого ресурса была своя таблица показаний
+LEGACY_TABLES = ("electricity", "water", "gas")
+
+def _migrate_v1(cursor):
+    owner_id = None
+    for table in LEGACY_TABLES:
+        columns = _columns(cursor, table)
+        if not columns:
+            continue
+        if "user_id" not in columns:
+            if owner_id is None:
+                owner_id = _legacy_owner_id(cursor)
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN user_id INTEGER")
+            cursor.execute(f"UPDATE {table} SET user_id = ?", (owner_id,))
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user_date ON {table} (user_id, date)")
+
+def _migrate_v2(cursor):
+    # Колонки накопительных агрегатов; заполняются при переносе в readings (v3)
+    for table in LEGACY_TABLES:
+        columns = _columns(cursor, table)
+        if not columns:
+            continue
+        for column, decl in (("delta", "REAL"), ("run_count", "INTEGER NOT NULL DEFAULT 0"), ("run_sum", "REAL NOT NULL DEFAULT 0")):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _migrate_v3(cursor):
+    # Три таблицы ресурсов -> meters + readings. Каждый пользователь получает
+    # счётчики по умолчанию, показания ресурса переносятся в его счётчик.
+    # Таблицы, ключом которых были (user_id, resource), пересоздаются по meter_id.
+    for table in ("monthly_totals", "analytics_watermark", "chart_files"):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    readings.create_tables(cursor)
+    nightly.create_tables(cursor)
+    charts.create_tables(cursor)
+
+    cursor.execute("SELECT user_id FROM users")
+    for (user_id,) in cursor.fetchall():
+        readings.ensure_meters(user_id, DEFAULT_METERS, cursor)
+    for table in LEGACY_TABLES:
+        if not _columns(cursor, table):
+            continue
+        name = RESOURCES[table]["name"]
+        cursor.execute(
+            f"INSERT OR IGNORE INTO meters (user_id, resource, name) SELECT DISTINCT user_id, ?, ? FROM {table}",
+            (table, name)
+        )
+        cursor.execute(f'''
+            INSERT INTO readings (meter_id, date, value)
+            SELECT m.meter_id, r.date, r.meter
+            FROM {table} r JOIN meters m ON m.user_id = r.user_id AND m.name = ?
+            ORDER BY r.id
+        ''', (name,))
+        cursor.execute(f"DROP TABLE {table}")
+
+    cursor.execute("SELECT DISTINCT meter_id FROM readings")
+    for (meter_id,) in cursor.fetchall():
+        readings.update_rollup(cursor, meter_id, "0000-00-00")
+    # Перенесённые показания уже проверялись прежними ночными расчётами
+    nightly.mark_all_processed(cursor)
+
+def _migrate_v4(cursor):
+    # Дата отключения: по ней обслуживание архивирует давно неактивных пользователей.
+    # Отключённым раньше отсчёт начинается с обновления
+    if "deactivated_at" not in _columns(cursor, "users"):
+        cursor.execute("ALTER TABLE users ADD COLUMN deactivated_at TEXT")
+    cursor.execute("UPDATE users SET deactivated_at = date('now') WHERE active = 0 AND deactivated_at IS NULL")
+
+def _migrate_v5(cursor):
+    # Одно показание на счётчик в день: из дублей (удаление, повторный ввод и /undo)
+    # остаётся последнее внесённое, дальше их не пускает уникальный индекс
+    duplicates = "id NOT IN (SELECT MAX(id) FROM readings GROUP BY meter_id, date)"
+    cursor.execute(f"SELECT meter_id, MIN(date) FROM readings WHERE {duplicates} GROUP BY meter_id")
+    affected = cursor.fetchall()
+    cursor.execute(f"DELETE FROM readings WHERE {duplicates}")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_readings_meter_day ON readings (meter_id, date)")
+    for meter_id, from_date in affected:
+        readings.update_rollup(cursor, meter_id, from_date)
+
+def _migrate_v6(cursor):
+    # Получатели рассылки забираются процессом перед отправкой (см. broadcast.py)
+    if "claimed_at" not in _columns(cursor, "send_queue"):
+        cursor.execute("ALTER TABLE send_queue ADD COLUMN claimed_at REAL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_send_queue_claimed ON send_queue (run_id, claimed_at) WHERE status = 3")
+
+# При совпадении версии схема не проверяется: новая таблица или индекс в
+# create_tables — тоже новая миграция, хотя бы пустая
+MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6]
+SCHEMA_VERSION = len(MIGRATIONS)
 
 def init_db():
-    conn = get_db()
-    cursor = conn.cursor()
-    for config in RESOURCES.values():
-        table = config["table"]
-        cursor.execute(f'''
-            CREATE TABLE IF NOT EXISTS {table} (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                meter REAL NOT NULL,
-                date TEXT NOT NULL
-            )
-        ''')
+    # Обычный перезапуск: схема актуальна — без замка записи и CREATE TABLE
+    if db.fetchone("PRAGMA user_version")[0] == SCHEMA_VERSION:
+        return
+    with db.transaction() as cursor:
+        _create_schema(cursor)
+    logging.info("Database initialized.")
+
+def _create_schema(cursor):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER PRIMARY KEY,
@@ -82,82 +195,159 @@ def init_db():
             remind_skipped BOOLEAN DEFAULT 0
         )
     ''')
-    conn.commit()
-    conn.close()
-    logging.info("Database initialized.")
-
-def load_active_users():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, remind_skipped FROM users WHERE active = 1")
-    rows = cursor.fetchall()
-    for user_id, skipped in rows:
-        active_users.add(user_id)
-        remind_skipped[user_id] = bool(skipped)
-    conn.close()
-    logging.info("Loaded %s active users.", len(active_users))
-
-init_db()
-load_active_users()
+    broadcast.create_tables(cursor)
+    state.SQLiteStateStore.create_tables(cursor)
+    reminders.create_tables(cursor)
+    tariffs.create_tables(cursor)
+    maintenance.create_tables(cursor)
+    cursor.execute("PRAGMA user_version")
+    version = cursor.fetchone()[0]
+    # Старые monthly_totals, analytics_watermark и chart_files пересоздаёт миграция v3
+    if version >= 3:
+        readings.create_tables(cursor)
+        nightly.create_tables(cursor)
+        charts.create_tables(cursor)
+    for target, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+        migrate(cursor)
+        cursor.execute(f"PRAGMA user_version = {target}")
+        logging.info("Database migrated to schema version %s.", target)
+
+# === ПОЛЬЗОВАТЕЛИ ===
+# Флаги пользователей читаются из таблицы users, а не из копии в памяти процесса
+def is_active_user(user_id):
+    row = db.fetchone("SELECT active FROM users WHERE user_id = ?", (user_id,))
+    return bool(row and row[0])
 
-# === ДЕАКТИВАЦИЯ ПОЛЬЗОВАТЕЛЯ ===
 def _deactivate_user(user_id):
-    if user_id in active_users:
-        active_users.discard(user_id)
-    if user_id in remind_skipped:
-        del remind_skipped[user_id]
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET active = 0 WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
-    logging.info("User %s deactivated.", user_id)
+    db.execute("UPDATE users SET active = 0, deactivated_at = date('now') WHERE user_id = ?", (user_id,))
+    logging.info("User %s deactivated.", user_id, extra={"user_id": user_id})
 
 # === ОТПРАВКА СООБЩЕНИЙ С ЭКРАНИРОВАНИЕМ И ВОЗВРАТОМ ===
-def safe_send(user_id, text, parse_mode="MarkdownV2", reply_markup=None):
-    if parse_mode == "MarkdownV2":
-        text = escape_markdown_v2(text)
+# Сообщения уходят через очередь чата (см. client.py): обработчик не ждёт Telegram,
+# порядок внутри чата сохраняется. wait=True — дождаться отправки и вернуть Message
+# (None при ошибке), без него возвращается Future, ошибки разбираются в фоне.
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "16"))
+outbox = client.Outbox(bot, workers=SEND_WORKERS)  # потоки стартуют при первой отправке
+
+def safe_send(user_id, text, parse_mode="MarkdownV2", reply_markup=None, escape=True, raise_on_flood=False, wait=False):
+    if parse_mode == "MarkdownV2" and escape:
+        text = render.escape_markdown_v2(text)
+    future = outbox.send(user_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+    if not wait:
+        future.add_done_callback(lambda f: _delivered(user_id, f))
+        return future
+    return _delivered(user_id, future, raise_on_flood)
+
+def _delivered(user_id, future, raise_on_flood=False):
     try:
-        return bot.send_message(user_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+        return future.result()
     except telebot.apihelper.ApiTelegramException as e:
-        if e.error_code == 400 and "chat not found" in e.description.lower():
-            logging.warning("Chat not found (400) for user %s.", user_id)
-            _deactivate_user(user_id)
-        elif e.error_code == 403 and "blocked" in e.description.lower():
-            logging.warning("User %s blocked the bot.", user_id)
-            _deactivate_user(user_id)
-        else:
-            logging.error("Telegram API error for user %s: %s", user_id, e)
+        if e.error_code == 429 and raise_on_flood:
+            retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 1)
+            raise broadcast.RetryAfter(retry_after)
+        _handle_api_error(user_id, e)
     except Exception as e:
-        logging.error("Failed to send message to %s: %s", user_id, e)
+        logging.error("Failed to send message to %s: %s", user_id, e, extra={"user_id": user_id})
     return None  # Важно: возвращаем None при ошибке
 
+def safe_edit(chat_id, method, *args, **kwargs):
+    # Правка сообщения в общей очереди чата — не обгонит ответы, отправленные раньше
+    def log_error(future):
+        if future.exception() is not None:
+            logging.error("Failed to %s for %s: %s", method.__name__, chat_id, future.exception(),
+                          extra={"user_id": chat_id})
+    future = outbox.call(chat_id, method, *args, **kwargs)
+    future.add_done_callback(log_error)
+    return future
+
+def _handle_api_error(user_id, e):
+    extra = {"user_id": user_id}
+    if e.error_code == 400 and "chat not found" in e.description.lower():
+        logging.warning("Chat not found (400) for user %s.", user_id, extra=extra)
+        _deactivate_user(user_id)
+    elif e.error_code == 403 and "blocked" in e.description.lower():
+        logging.warning("User %s blocked the bot.", user_id, extra=extra)
+        _deactivate_user(user_id)
+    else:
+        logging.error("Telegram API error for user %s: %s", user_id, e, extra=extra)
+
+def safe_send_photo(user_id, photo, caption=None):
+    # Возвращает file_id самой большой версии картинки или None. Вызывается из очереди
+    # чата (см. charts.send_chart) — время запроса там и замеряется, под меткой send_photo
+    try:
+        return bot.send_photo(user_id, photo, caption=caption).photo[-1].file_id
+    except telebot.apihelper.ApiTelegramException as e:
+        metrics.TELEGRAM_ERRORS.inc(method="send_photo", code=e.error_code)
+        _handle_api_error(user_id, e)
+    except Exception as e:
+        metrics.TELEGRAM_ERRORS.inc(method="send_photo", code="network")
+        logging.error("Failed to send photo to %s: %s", user_id, e, extra={"user_id": user_id})
+    return None
+
+# === СЧЁТЧИКИ ПОЛЬЗОВАТЕЛЯ ===
+# Строка счётчика — (meter_id, resource, name, tariff), см. readings.py
+def meter_label(meter):
+    return f"{RESOURCES[meter[1]]['icon']} {meter[2]}"
+
+def meter_unit(meter):
+    return RESOURCES[meter[1]]["unit"]
+
+def meter_from_menu(message):
+    # Счётчик, чья кнопка меню нажата, или None
+    if message.content_type != 'text':
+        return None
+    for meter in readings.list_meters(message.from_user.id):
+        if meter_label(meter) == message.text:
+            return meter
+    return None
+
+def find_meter(meters, query):
+    # По названию счётчика или по ресурсу, если счётчик этого ресурса один.
+    # Не нашли — ValueError с текстом для пользователя
+    query = query.strip().lower()
+    for meter in meters:
+        if meter[2].lower() == query:
+            return meter
+    resource = RESOURCE_ALIASES.get(query)
+    if resource is None:
+        raise ValueError(f"неизвестный счётчик «{query}»")
+    candidates = [meter for meter in meters if meter[1] == resource]
+    if len(candidates) != 1:
+        names = ", ".join(meter[2] for meter in candidates) or "нет"
+        raise ValueError(f"уточните счётчик ресурса «{query}»: {names}")
+    return candidates[0]
+
 # === ОТПРАВКА МЕНЮ ===
+# Клавиатура меню — кнопки счётчиков пользователя; JSON собирается один раз на
+# набор кнопок, её же прикрепляем к последнему сообщению обработчика вместо
+# отдельного «Выберите действие» (одна отправка вместо двух)
+@functools.lru_cache(maxsize=1024)
+def _menu_markup(labels):
+    rows = [list(labels[i:i + 3]) for i in range(0, len(labels), 3)]
+    return render.reply_keyboard(rows + [["📆 История", "📈 График"]])
+
+def menu_keyboard(user_id):
+    labels = tuple(meter_label(meter) for meter in readings.list_meters(user_id))
+    return _menu_markup(labels)
+
 def send_menu(user_id):
-    keyboard = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True)
-    btn1 = telebot.types.KeyboardButton("⚡ Электричество")
-    btn2 = telebot.types.KeyboardButton("💧 Вода")
-    btn3 = telebot.types.KeyboardButton("🔥 Газ")
-    btn4 = telebot.types.KeyboardButton("📆 История")
-    keyboard.row(btn1, btn2, btn3)
-    keyboard.row(btn4)
-    safe_send(user_id, "Выберите действие через меню:", reply_markup=keyboard)
+    safe_send(user_id, render.MENU_PROMPT, reply_markup=menu_keyboard(user_id), escape=False)
 
 # === /start ===
 @bot.message_handler(commands=['start'])
 def start_message(message):
     user_id = message.from_user.id
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
+    was_active = is_active_user(user_id)
+    # Давно ушедший пользователь мог быть перенесён в архив обслуживанием. Без оглядки
+    # на was_active: /start во время прогона успевает завести пользователя заново
+    maintenance.restore_user(user_id)
+    db.execute(
         'INSERT OR REPLACE INTO users (user_id, active, remind_skipped) VALUES (?, 1, COALESCE((SELECT remind_skipped FROM users WHERE user_id = ?), 0))',
         (user_id, user_id)
     )
-    conn.commit()
-    conn.close()
-    if user_id not in active_users:
-        active_users.add(user_id)
-        remind_skipped[user_id] = False
+    readings.ensure_meters(user_id, DEFAULT_METERS)
+    state_store.delete("input", user_id)
+    if not was_active:
         logging.info("User %s added.", user_id)
     send_menu(user_id)
 
@@ -170,10 +360,17 @@ def help_message(message):
         "• ⚡ Электричество\n"
         "• 💧 Вода\n"
         "• 🔥 Газ\n\n"
+        "Счётчиков одного ресурса может быть несколько: горячая и холодная вода, "
+        "день и ночь у электричества — см. /meters.\n\n"
         "Каждый месяц 10-го числа вам придёт напоминание.\n\n"
         "Команды:\n"
         "• /start — главное меню\n"
         "• /help — эта справка\n"
+        "• /meters — ваши счётчики, /addmeter — добавить счётчик\n"
+        "• /tariff — цены: стоимость в истории и напоминаниях\n"
+        "• /history — вся история одним потоком сообщений\n"
+        "• /export — выгрузить историю файлом (csv или jsonl)\n"
+        "• /import — загрузить историю из файла\n"
         "• /del — удалить запись\n"
         "• /undo — отменить удаление\n"
         "• /cancel — отмена и возврат в меню"
@@ -182,10 +379,167 @@ def help_message(message):
 
 @bot.message_handler(commands=['cancel'])
 def cancel(message):
+    state_store.delete("input", message.from_user.id)
     send_menu(message.from_user.id)
 
+# === /meters и /addmeter — СЧЁТЧИКИ ===
+@bot.message_handler(commands=['meters'])
+def show_meters(message):
+    user_id = message.from_user.id
+    lines = ["🔢 Ваши счётчики:"]
+    for meter in readings.list_meters(user_id):
+        zone = {"day": " (день)", "night": " (ночь)"}.get(meter[3], "")
+        lines.append(f"• {meter_label(meter)}{zone}, {meter_unit(meter)}")
+    lines.append(
+        "\nДобавить счётчик: /addmeter ресурс название [день|ночь]\n"
+        "Например: /addmeter вода Горячая вода или /addmeter свет Ночь ночь"
+    )
+    safe_send(user_id, "\n".join(lines), reply_markup=menu_keyboard(user_id))
+
+@bot.message_handler(commands=['addmeter'])
+def create_meter(message):
+    user_id = message.from_user.id
+    parts = message.text.split(maxsplit=2)
+    if len(parts) != 3 or parts[1].lower() not in RESOURCE_ALIASES:
+        safe_send(user_id, "❌ Используйте: /addmeter ресурс название [день|ночь]. Ресурсы: электричество, вода, газ.")
+        return
+
+    resource = RESOURCE_ALIASES[parts[1].lower()]
+    name = parts[2].strip()
+    tariff = None
+    words = name.rsplit(maxsplit=1)
+    if resource == "electricity" and len(words) == 2 and words[1].lower() in TARIFF_ZONES:
+        name, tariff = words[0], TARIFF_ZONES[words[1].lower()]
+    if len(name) > MAX_METER_NAME:
+        safe_send(user_id, f"❌ Название не длиннее {MAX_METER_NAME} символов.")
+        return
+
+    meter_id = readings.add_meter(user_id, resource, name, tariff)
+    if meter_id is None:
+        safe_send(user_id, f"❌ Счётчик «{name}» уже есть.")
+        return
+    logging.info("Meter %s (%s) added.", meter_id, resource, extra={"user_id": user_id})
+    safe_send(user_id, f"✅ Счётчик добавлен: {meter_label((meter_id, resource, name, tariff))}",
+              reply_markup=menu_keyboard(user_id))
+
+# === /tariff — ЦЕНЫ ===
+TARIFF_HELP = (
+    "Задать цену: /tariff ресурс|счётчик название [день|ночь] цена [до объём цена ...] [с ДД.ММ.ГГГГ]\n"
+    "Например:\n"
+    "• /tariff вода 45.5 — цена за м³ для всех счётчиков воды\n"
+    "• /tariff счётчик Горячая вода 250 — цена только для этого счётчика\n"
+    "• /tariff свет ночь 3.1 с 01.07.2025 — ночная зона с 1 июля\n"
+    "• /tariff Газ 7 до 100 9.5 — до 100 м³ в месяц по 7, сверх — по 9.5"
+)
+DEFAULT_VALID_FROM = "2000-01-01"
+
+def _parse_tariff(meters, words):
+    # Разбор аргументов /tariff: ((resource, zone, meter_id), tiers, valid_from).
+    # Ошибка — ValueError с текстом для пользователя
+    valid_from = DEFAULT_VALID_FROM
+    if len(words) >= 2 and words[-2].lower() == "с":
+        try:
+            valid_from = datetime.strptime(words[-1], "%d.%m.%Y").strftime("%Y-%m-%d")
+        except ValueError:
+            raise ValueError("неверная дата, используйте ДД.ММ.ГГГГ")
+        words = words[:-2]
+
+    # Цель — всё до первого числа
+    start = next((i for i, word in enumerate(words) if _is_number(word)), None)
+    if not start:
+        raise ValueError("укажите счётчик или ресурс и цену")
+    target, numbers = words[:start], words[start:]
+
+    # Ресурс — цена для всех его счётчиков (счётчики по умолчанию называются как
+    # ресурсы, поэтому ресурс важнее названия); отдельный счётчик — «счётчик <название>»
+    if target[0].lower() in ("счётчик", "счетчик"):
+        query = " ".join(target[1:])
+        meter = next((meter for meter in meters if meter[2].lower() == query.lower()), None)
+        if meter is None:
+            raise ValueError(f"неизвестный счётчик «{query}»")
+        scope = (meter[1], tariffs.ANY_ZONE, meter[0])
+    else:
+        zone = tariffs.ANY_ZONE
+        if len(target) > 1 and target[-1].lower() in TARIFF_ZONES:
+            zone = TARIFF_ZONES[target[-1].lower()]
+            target = target[:-1]
+        query = " ".join(target)
+        if query.lower() not in RESOURCE_ALIASES:
+            raise ValueError(f"неизвестный ресурс «{query}», для счётчика: /tariff счётчик {query} …")
+        resource = RESOURCE_ALIASES[query.lower()]
+        if zone and resource != "electricity":
+            raise ValueError("зоны день/ночь бывают только у электричества")
+        scope = (resource, zone, tariffs.ANY_METER)
+
+    # цена [до объём цена ...]: каждая цена действует до следующего «до»
+    tiers = []
+    price = numbers[0]
+    rest = numbers[1:]
+    while rest:
+        if len(rest) < 3 or rest[0].lower() != "до" or not _is_number(rest[1]) or not _is_number(rest[2]):
+            raise ValueError("ступени задаются как «до объём цена»")
+        limit = float(rest[1].replace(",", "."))
+        if tiers and limit <= tiers[-1][0]:
+            raise ValueError("границы ступеней должны возрастать")
+        tiers.append([limit, float(price.replace(",", "."))])
+        price = rest[2]
+        rest = rest[3:]
+    tiers.append([None, float(price.replace(",", "."))])
+    if any(tier_price < 0 for _, tier_price in tiers) or (tiers[0][0] is not None and tiers[0][0] <= 0):
+        raise ValueError("цены и объёмы не могут быть отрицательными")
+    return scope, tiers, valid_from
+
+def _is_number(word):
+    try:
+        float(word.replace(",", "."))
+    except ValueError:
+        return False
+    return True
+
+def _format_tiers(tiers, unit):
+    if len(tiers) == 1:
+        return f"{tiers[0][1]:g} ₽/{unit}"
+    parts = []
+    lower = 0
+    for limit, price in tiers:
+        parts.append(f"{price:g} ₽ до {limit:g}" if limit is not None else f"{price:g} ₽ сверх {lower:g}")
+        lower = limit
+    return ", ".join(parts) + f" {unit}/мес."
+
+@bot.message_handler(commands=['tariff'])
+def set_tariff(message):
+    user_id = message.from_user.id
+    words = message.text.split()[1:]
+    meters = readings.list_meters(user_id)
+    if not words:
+        names = {meter[0]: meter[2] for meter in meters}
+        lines = ["💰 Ваши цены:"]
+        for resource, zone, meter_id, valid_from, tiers in tariffs.list_prices(user_id):
+            scope = f"счётчик «{names.get(meter_id, '?')}»" if meter_id else f"все: {RESOURCES[resource]['name']}"
+            scope += {"day": " (день)", "night": " (ночь)"}.get(zone, "")
+            since = "" if valid_from == DEFAULT_VALID_FROM else \
+                " с " + datetime.strptime(valid_from, "%Y-%m-%d").strftime("%d.%m.%Y")
+            lines.append(f"• {scope}: {_format_tiers(tiers, RESOURCES[resource]['unit'])}{since}")
+        if len(lines) == 1:
+            lines.append("пока не заданы")
+        lines.append("\n" + TARIFF_HELP)
+        safe_send(user_id, "\n".join(lines))
+        return
+
+    try:
+        (resource, zone, meter_id), tiers, valid_from = _parse_tariff(meters, words)
+    except ValueError as e:
+        error = str(e)
+        safe_send(user_id, f"❌ {error[:1].upper()}{error[1:]}.\n\n{TARIFF_HELP}")
+        return
+    tariffs.set_price(user_id, resource, tiers, valid_from, zone, meter_id)
+    logging.info("Tariff for %s set.", resource, extra={"user_id": user_id})
+    safe_send(user_id, f"✅ Цена сохранена: {_format_tiers(tiers, RESOURCES[resource]['unit'])}\n"
+                       "Стоимость появится в истории и напоминаниях.")
+
 # === /del — УДАЛЕНИЕ ЗАПИСИ С КНОПКАМИ ===
 @bot.message_handler(commands=['del'])
+@metrics.timed
 def delete_entry(message):
     user_id = message.from_user.id
     text = message.text.strip()
@@ -195,10 +549,10 @@ def delete_entry(message):
         help_text = (
             "❌ Неверный формат команды.\n\n"
             "Используйте:\n"
-            "`/del ДД.ММ.ГГГГ ресурс`\n\n"
+            "`/del ДД.ММ.ГГГГ счётчик`\n\n"
             "Пример:\n"
             "`/del 25.11.2025 электричество`\n\n"
-            "Доступные ресурсы:\n"
+            "Счётчик — название из /meters или ресурс, если счётчик у него один:\n"
             "• `электричество` (или `электро`, `свет`)\n"
             "• `вода`\n"
             "• `газ`"
@@ -206,15 +560,15 @@ def delete_entry(message):
         safe_send(user_id, help_text, parse_mode="MarkdownV2")
         return
 
-    _, date_str, resource_input = parts
-    resource_input = resource_input.lower()
-
-    if resource_input not in RESOURCE_ALIASES:
-        safe_send(user_id, "❌ Неизвестный ресурс. Введите `/del` для подсказки.", parse_mode="MarkdownV2")
+    _, date_str, meter_input = parts
+    try:
+        meter = find_meter(readings.list_meters(user_id), meter_input)
+    except ValueError as e:
+        error = str(e)
+        safe_send(user_id, f"❌ {error[:1].upper()}{error[1:]}. Введите `/del` для подсказки.", parse_mode="MarkdownV2")
         return
 
-    table = RESOURCE_ALIASES[resource_input]
-    display_name = TABLE_TO_DISPLAY[table]
+    display_name = meter_label(meter)
 
     try:
         day, month, year = map(int, date_str.split('.'))
@@ -225,156 +579,137 @@ def delete_entry(message):
         safe_send(user_id, "❌ Неверный формат даты. Используйте: `ДД.ММ.ГГГГ`", parse_mode="MarkdownV2")
         return
 
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(f"SELECT meter FROM {table} WHERE date = ?", (date_db,))
-    row = cursor.fetchone()
-    conn.close()
+    meter_value = readings.find_reading(meter[0], date_db)
 
-    if not row:
+    if meter_value is None:
         safe_send(user_id, f"❌ Запись за {date_str} в разделе *{display_name}* не найдена.", parse_mode="MarkdownV2")
         return
 
-    meter_value = row[0]
     question = f"Вы точно хотите удалить запись?\nДата: {date_str}, {display_name}: {int(round(meter_value))}?"
 
-    sent = safe_send(user_id, question, parse_mode="MarkdownV2")
-    if not sent:
-        logging.error("Не удалось отправить сообщение подтверждения.")
-        return
-
-    keyboard = telebot.types.InlineKeyboardMarkup()
-    btn_yes = telebot.types.InlineKeyboardButton("✅ Да", callback_data=f"confirm_delete:{table}:{date_db}:{meter_value}")
-    btn_no = telebot.types.InlineKeyboardButton("❌ Нет", callback_data="cancel_delete")
-    keyboard.add(btn_yes, btn_no)
-
-    try:
-        bot.edit_message_reply_markup(chat_id=sent.chat.id, message_id=sent.message_id, reply_markup=keyboard)
-    except Exception as e:
-        logging.error("Не удалось добавить кнопки: %s", e)
-        safe_send(user_id, "⚠️ Не удалось добавить кнопки. Попробуйте снова.")
+    # Кнопки приходят вместе с вопросом — один запрос вместо отправки и правки
+    safe_send(user_id, question, parse_mode="MarkdownV2",
+              reply_markup=render.delete_keyboard(meter[0], date_db, meter_value))
 
 # === КОЛБЭКИ УДАЛЕНИЯ ===
 @bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_delete:"))
+@metrics.timed
 def confirm_delete(call):
     user_id = call.from_user.id
     try:
-        _, table, date_db, meter_str = call.data.split(":", 3)
+        _, meter_id, date_db, meter_str = call.data.split(":", 3)
         meter_value = float(meter_str)
-        display_name = TABLE_TO_DISPLAY[table]
+        meter = readings.get_meter(int(meter_id), user_id)
+        if meter is None:
+            raise ValueError(f"meter {meter_id} not found for user {user_id}")
+        display_name = meter_label(meter)
         date_str = datetime.strptime(date_db, "%Y-%m-%d").strftime("%d.%m.%Y")
 
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute(f"DELETE FROM {table} WHERE date = ? AND meter = ?", (date_db, meter_value))
-        if cursor.rowcount > 0:
-            last_deleted[user_id] = (table, date_db, meter_value, datetime.now(timezone('Europe/Moscow')))
-            conn.commit()
-            safe_send(user_id, f"✅ Запись удалена:\n*{display_name}*, дата: {date_str}, показания: {int(round(meter_value))}", parse_mode="MarkdownV2")
+        deleted = readings.delete_reading(meter[0], date_db, meter_value)
+        if deleted > 0:
+            state_store.set("last_deleted", user_id, [meter[0], date_db, meter_value], ttl=UNDO_TTL)
+            text = render.DELETED.format(name=display_name, date=date_str, value=int(round(meter_value)))
         else:
-            safe_send(user_id, "❌ Запись не найдена — возможно, уже удалена.")
-        conn.close()
+            text = render.escape_markdown_v2("❌ Запись не найдена — возможно, уже удалена.")
     except Exception as e:
         logging.error("Delete error: %s", e)
-        safe_send(user_id, "❌ Ошибка при удалении.")
-    finally:
-        try:
-            bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
-        except:
-            pass
-    send_menu(user_id)
+        text = render.escape_markdown_v2("❌ Ошибка при удалении.")
+    safe_send(user_id, text, reply_markup=menu_keyboard(user_id), escape=False)
+    # Кнопки вопроса снимаем следом за ответом — пользователь не ждёт лишний запрос
+    safe_edit(call.message.chat.id, bot.edit_message_reply_markup, call.message.chat.id,
+              call.message.message_id, reply_markup=None)
 
 @bot.callback_query_handler(func=lambda call: call.data == "cancel_delete")
 def cancel_delete(call):
     user_id = call.from_user.id
-    try:
-        bot.edit_message_text("❌ Удаление отменено.", call.message.chat.id, call.message.message_id)
-    except Exception as e:
-        logging.error("Ошибка при редактировании: %s", e)
+    safe_edit(call.message.chat.id, bot.edit_message_text, "❌ Удаление отменено.",
+              call.message.chat.id, call.message.message_id)
     send_menu(user_id)
 
 # === /undo — ОТМЕНА УДАЛЕНИЯ ===
 @bot.message_handler(commands=['undo'])
 def undo_delete(message):
     user_id = message.from_user.id
-    if user_id not in last_deleted:
-        safe_send(user_id, "❌ Нет последней операции удаления для отмены.")
-        return
-
-    table, date_db, meter_value, deleted_at = last_deleted[user_id]
-    now = datetime.now(timezone('Europe/Moscow'))
-    if (now - deleted_at).total_seconds() > 300:  # 5 минут
-        safe_send(user_id, "❌ Отмена невозможна — прошло более 5 минут.")
-        del last_deleted[user_id]
+    # Запись живёт UNDO_TTL секунд, после этого отмена невозможна
+    deleted = state_store.pop("last_deleted", user_id)
+    if deleted is None:
+        safe_send(user_id, "❌ Нет удаления для отмены (отменить можно в течение 5 минут).")
         return
 
-    conn = get_db()
-    cursor = conn.cursor()
+    meter_id, date_db, meter_value = deleted
     try:
-        cursor.execute(f"INSERT INTO {table} (meter, date) VALUES (?, ?)", (meter_value, date_db))
-        conn.commit()
-        display_name = TABLE_TO_DISPLAY[table]
+        meter = readings.get_meter(meter_id, user_id)
+        display_name = meter_label(meter)
         date_str = datetime.strptime(date_db, "%Y-%m-%d").strftime("%d.%m.%Y")
-        safe_send(user_id, f"✅ Восстановлено:\n*{display_name}*, дата: {date_str}, показания: {int(round(meter_value))}", parse_mode="MarkdownV2")
-        del last_deleted[user_id]
+        # После удаления на эту дату могли внести новое показание, а соседние — изменить
+        prev_value, next_value = readings.neighbours(meter[0], date_db)
+        if ((prev_value is not None and meter_value < prev_value)
+                or (next_value is not None and meter_value > next_value)):
+            text = render.escape_markdown_v2(
+                f"❌ Не удалось восстановить: показания не могут уменьшаться.\n"
+                f"Удалённое значение {int(round(meter_value))} не помещается между соседними показаниями."
+            )
+        elif readings.insert_reading(meter[0], meter_value, date_db):
+            text = render.RESTORED.format(name=display_name, date=date_str, value=int(round(meter_value)))
+        else:
+            current = readings.find_reading(meter[0], date_db)
+            text = render.escape_markdown_v2(
+                f"❌ Не удалось восстановить: за {date_str} уже внесено показание {int(round(current))}."
+            )
     except Exception as e:
-        safe_send(user_id, "❌ Не удалось восстановить: ошибка базы данных.")
+        text = render.escape_markdown_v2("❌ Не удалось восстановить: ошибка базы данных.")
         logging.error("Undo error: %s", e)
-    finally:
-        conn.close()
-    send_menu(user_id)
+    safe_send(user_id, text, reply_markup=menu_keyboard(user_id), escape=False)
 
-# === ПРОВЕРКА: ВВЕДЕНЫ ЛИ ЗА МЕСЯЦ ===
-def has_user_entered_current_month_data():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT date('now', 'start of month')")
-    first_day = cursor.fetchone()[0]
-    for config in RESOURCES.values():
-        cursor.execute(f"SELECT 1 FROM {config['table']} WHERE date >= ? LIMIT 1", (first_day,))
-        if cursor.fetchone():
-            conn.close()
-            return True
-    conn.close()
-    return False
+# === ПРОВЕРКА: КОМУ НАПОМНИТЬ ===
+# Пользователи (из user_ids или все), которые ещё не вносили показания в этом месяце
+def users_to_remind(user_ids=None):
+    first_day = datetime.now(timezone('UTC')).strftime("%Y-%m-01")
+    return readings.users_without_readings_since(first_day, user_ids)
 
 # === ВВОД ПОКАЗАНИЙ ===
-@bot.message_handler(func=lambda message: message.text in RESOURCES.keys())
+# Ожидание ввода хранится в state_store, а не в register_next_step_handler:
+# его видят все процессы бота и оно не теряется при перезапуске
+def _awaiting_input(message):
+    return (message.content_type == 'text' and not message.text.startswith('/')
+            and state_store.get("input", message.from_user.id) is not None)
+
+@bot.message_handler(func=_awaiting_input)
+def handle_pending_input(message):
+    meter_id = state_store.pop("input", message.from_user.id)
+    if meter_id is not None:
+        save_meter_reading(message, meter_id)
+
+@bot.message_handler(func=lambda message: meter_from_menu(message) is not None)
 def handle_meter_input(message):
-    resource_key = message.text
-    table = RESOURCES[resource_key]["table"]
-    safe_send(message.from_user.id, f"Введите показания счётчика {resource_key.split()[1].lower()}:")
-    bot.register_next_step_handler(message, lambda msg: save_meter_reading(msg, table))
+    meter = meter_from_menu(message)
+    safe_send(message.from_user.id, render.ENTER_READING.format(resource=meter[2].lower()), escape=False)
+    state_store.set("input", message.from_user.id, meter[0], ttl=INPUT_TTL)
 
-def save_meter_reading(message, table):
+@metrics.timed
+def save_meter_reading(message, meter_id):
     user_id = message.from_user.id
     try:
         meter_value = float(message.text)
+        if not math.isfinite(meter_value):
+            raise ValueError(message.text)
     except ValueError:
-        safe_send(user_id, "❌ Ошибка: введите корректное число!")
-        send_menu(user_id)
+        safe_send(user_id, render.NOT_A_NUMBER, reply_markup=menu_keyboard(user_id), escape=False)
         return
 
-    if table not in ALLOWED_TABLES:
-        safe_send(user_id, "❌ Недопустимый ресурс.")
-        send_menu(user_id)
+    meter = readings.get_meter(meter_id, user_id)
+    if meter is None:
+        safe_send(user_id, "❌ Недопустимый счётчик.", reply_markup=menu_keyboard(user_id))
         return
 
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute(f"SELECT 1 FROM {table} WHERE date = date('now') LIMIT 1")
-    if cursor.fetchone():
-        safe_send(user_id, "⚠️ Показания на сегодня уже внесены!")
-        conn.close()
-        send_menu(user_id)
+    today = datetime.now(timezone('UTC')).strftime("%Y-%m-%d")
+    if readings.has_reading_on(meter_id, today):
+        safe_send(user_id, render.ALREADY_TODAY, reply_markup=menu_keyboard(user_id), escape=False)
         return
 
-    cursor.execute(f"SELECT meter FROM {table} ORDER BY date DESC LIMIT 1")
-    row = cursor.fetchone()
+    prev_value = readings.latest_reading(meter_id)
 
-    if row:
-        prev_value = float(row[0])
+    if prev_value is not None:
         if meter_value < prev_value:
             prev_rounded = int(round(prev_value))
             current_rounded = int(round(meter_value))
@@ -386,83 +721,320 @@ def save_meter_reading(message, table):
                 f"Введите корректное значение."
             )
             safe_send(user_id, error_text)
-            conn.close()
-            resource_name = TABLE_TO_DISPLAY[table].split()[1].lower()
-            safe_send(user_id, f"Введите показания счётчика {resource_name}:")
-            bot.register_next_step_handler(message, lambda msg: save_meter_reading(msg, table))
+            safe_send(user_id, render.ENTER_READING.format(resource=meter[2].lower()), escape=False)
+            state_store.set("input", user_id, meter_id, ttl=INPUT_TTL)
             return
 
-    cursor.execute(f'INSERT INTO {table} (meter, date) VALUES (?, date("now"))', (meter_value,))
-    conn.commit()
-    conn.close()
+    if not readings.insert_reading(meter_id, meter_value, today):
+        safe_send(user_id, render.ALREADY_TODAY, reply_markup=menu_keyboard(user_id), escape=False)
+        return
 
-    display_name = TABLE_TO_DISPLAY[table]
-    unit = RESOURCES[display_name]["unit"]
+    unit = meter_unit(meter)
     rounded_value = int(round(meter_value))
 
-    safe_send(user_id, f"✅ Показания сохранены: {rounded_value} {unit}")
-
-    if row:
-        consumption = meter_value - prev_value
-        safe_send(user_id, f"💡 Расход с прошлого раза: {int(round(consumption))} {unit}")
+    # Подтверждение, расход и меню — одним сообщением
+    if prev_value is not None:
+        consumption = render.CONSUMPTION.format(consumption=int(round(meter_value - prev_value)), unit=unit)
     else:
-        safe_send(user_id, "🆕 Это первое показание — нет данных для сравнения.")
-
-    send_menu(user_id)
+        consumption = render.FIRST_READING
+    text = render.SAVED.format(value=rounded_value, unit=unit) + "\n" + consumption
+    safe_send(user_id, text, reply_markup=menu_keyboard(user_id), escape=False)
 
 # === СТАТИСТИКА ===
+HISTORY_PAGE_SIZE = 20
+MAX_MESSAGE_LENGTH = 4096
+
+def _tg_len(text):
+    # Telegram считает длину в UTF-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+# Колонка «Сумма» — только у счётчиков, для которых заданы цены (/tariff)
+def _history_header(with_cost=False):
+    header = f"{'Дата':<12} {'Показ.':<8} {'Расход':<8} {'Сред.':<8} {'Ед.':<5}"
+    if with_cost:
+        return header + f" {'Сумма':>9}\n" + "-" * 60 + "\n"
+    return header + "\n" + "-" * 50 + "\n"
+
+def _history_line(row, unit, cost=None, with_cost=False):
+    date_str, meter_val, delta, avg = row
+    reading = int(round(meter_val))
+    if delta is None:
+        consumption = "-"
+        avg_str = "-"
+    else:
+        consumption = int(round(delta))
+        avg_str = str(int(round(avg)))
+    line = f"{date_str:<12} {reading:<8} {str(consumption):<8} {avg_str:<8} {unit:<5}"
+    if with_cost:
+        line += f" {'-' if cost is None else f'{cost:.2f}':>9}"
+    return line + "\n"
+
+def _priced_rows(user_id, meter, rows, month_before=None):
+    # Пары (строка, стоимость) и признак, есть ли у счётчика цены.
+    # month_before() — расход месяца до первой строки, считается только при наличии цен
+    index = tariffs.price_index(user_id)
+    if not index.covers(meter):
+        return ((row, None) for row in rows), False
+    return tariffs.priced(index, meter, rows, month_before() if month_before else 0.0), True
+
+def _history_page(user_id, meter, before=None, after=None):
+    rows, has_older, has_newer = readings.history_page(meter[0], HISTORY_PAGE_SIZE, before, after)
+    display_name = meter_label(meter)
+    if not rows:
+        return render.escape_markdown_v2(f"📋 {display_name}: нет данных."), None
+
+    unit = meter_unit(meter)
+    # Для ступенчатой цены нужен расход месяца до первой строки страницы
+    pairs, with_cost = _priced_rows(user_id, meter, rows, lambda: readings.month_consumption_before(meter[0], rows[0][0]))
+    body = _history_header(with_cost) + "".join(_history_line(row, unit, cost, with_cost) for row, cost in pairs)
+    text = render.escape_markdown_v2(f"📋 {display_name}") + "\n```\n" + render.escape_code_v2(body) + "```"
+
+    keyboard = None
+    if has_older or has_newer:
+        buttons = []
+        if has_older:
+            buttons.append(("◀", f"hist:{meter[0]}:older:{rows[0][0]}"))
+        if has_newer:
+            buttons.append(("▶", f"hist:{meter[0]}:newer:{rows[-1][0]}"))
+        keyboard = render.inline_keyboard([buttons])
+    return text, keyboard
+
+def _history_chunks(display_name, pairs, unit, with_cost=False):
+    # Режет поток пар (строка, стоимость) на сообщения не длиннее MAX_MESSAGE_LENGTH,
+    # каждое — самостоятельный корректный блок ``` с шапкой таблицы
+    title = render.escape_markdown_v2(f"📋 {display_name}") + "\n"
+    header = "```\n" + render.escape_code_v2(_history_header(with_cost))
+    footer = "```"
+    chunk = [title, header]
+    size = _tg_len(title) + _tg_len(header) + len(footer)
+    has_rows = False
+    for row, cost in pairs:
+        line = render.escape_code_v2(_history_line(row, unit, cost, with_cost))
+        line_len = _tg_len(line)
+        if has_rows and size + line_len > MAX_MESSAGE_LENGTH:
+            yield "".join(chunk) + footer
+            chunk = [header]
+            size = _tg_len(header) + len(footer)
+        chunk.append(line)
+        size += line_len
+        has_rows = True
+    if has_rows:
+        yield "".join(chunk) + footer
+
 @bot.message_handler(func=lambda message: message.text == "📆 История")
+@metrics.timed
 def monthly_stats(message):
     user_id = message.from_user.id
-    if user_id not in active_users:
+    if not is_active_user(user_id):
         return
 
-    conn = get_db()
-    cursor = conn.cursor()
+    for meter in readings.list_meters(user_id):
+        text, keyboard = _history_page(user_id, meter)
+        safe_send(user_id, text, reply_markup=keyboard, escape=False)
+
+    send_menu(user_id)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("hist:"))
+def history_page_callback(call):
+    user_id = call.from_user.id
+    try:
+        _, meter_id, direction, date_db = call.data.split(":", 3)
+        meter = readings.get_meter(int(meter_id), user_id)
+        if meter is None:
+            raise ValueError(meter_id)
+    except ValueError:
+        bot.answer_callback_query(call.id)
+        return
 
-    for display_name, config in RESOURCES.items():
-        table = config["table"]
-        unit = config["unit"]
-        cursor.execute(f"SELECT meter, date FROM {table} ORDER BY date ASC")
-        rows = cursor.fetchall()
+    if direction == "older":
+        text, keyboard = _history_page(user_id, meter, before=date_db)
+    else:
+        text, keyboard = _history_page(user_id, meter, after=date_db)
+    safe_edit(call.message.chat.id, bot.edit_message_text, text, call.message.chat.id, call.message.message_id,
+              parse_mode="MarkdownV2", reply_markup=keyboard)
+    bot.answer_callback_query(call.id)
+
+# === ГРАФИКИ ===
+@bot.message_handler(func=lambda message: message.text == "📈 График")
+def send_charts(message):
+    user_id = message.from_user.id
+    if not is_active_user(user_id):
+        return
 
-        data = []
-        for row in rows:
-            try:
-                data.append((row[1], float(row[0])))
-            except:
-                continue
+    empty = []
+    for meter in readings.list_meters(user_id):
+        display_name = meter_label(meter)
+        caption = f"{display_name}: расход по месяцам"
+        sent = charts.send_chart(
+            meter[0], meter[2], meter_unit(meter),
+            lambda photo, caption=caption: safe_send_photo(user_id, photo, caption),
+            lambda fn, *args: outbox.call(user_id, fn, *args)
+        )
+        if not sent:
+            empty.append(display_name)
+    if empty:
+        safe_send(user_id, "Для графика нужно минимум два показания: " + ", ".join(empty))
+
+# === /history — ПОЛНАЯ ИСТОРИЯ ПОТОКОМ ===
+@bot.message_handler(commands=['history'])
+def stream_history(message):
+    user_id = message.from_user.id
+    parts = message.text.strip().split(maxsplit=1)
+    meters = readings.list_meters(user_id)
+    if len(parts) == 2:
+        # Название счётчика или ресурс — тогда все счётчики этого ресурса
+        query = parts[1].lower()
+        resource = RESOURCE_ALIASES.get(query)
+        meters = [meter for meter in meters if meter[2].lower() == query or meter[1] == resource]
+        if not meters:
+            safe_send(user_id, "❌ Неизвестный счётчик. Пример: `/history вода`", parse_mode="MarkdownV2")
+            return
 
-        if not data:
+    for meter in meters:
+        display_name = meter_label(meter)
+        pairs, with_cost = _priced_rows(user_id, meter, readings.iter_history(meter[0]))
+        chunks = _history_chunks(display_name, pairs, meter_unit(meter), with_cost)
+        first = next(chunks, None)
+        if first is None:
             safe_send(user_id, f"📋 {display_name}: нет данных.")
             continue
+        # Ждём каждую отправку: следующий кусок читается из базы только после неё
+        if safe_send(user_id, first, escape=False, wait=True) is None:
+            continue
+        for chunk in chunks:
+            if safe_send(user_id, chunk, escape=False, wait=True) is None:
+                break
 
-        data.sort(key=lambda x: x[0])
-        lines = [f"📋 {display_name}\n", "```\n"]
-        lines.append(f"{'Дата':<12} {'Показ.':<8} {'Расход':<8} {'Сред.':<8} {'Ед.':<5}\n")
-        lines.append("-" * 50 + "\n")
-
-        consumptions = []
-        for i, (date_str, meter_val) in enumerate(data):
-            reading = int(round(meter_val))
-            if i == 0:
-                consumption = "-"
-                avg_str = "-"
-            else:
-                prev = data[i-1][1]
-                current_consumption = int(round(meter_val - prev))
-                consumption = current_consumption
-                consumptions.append(current_consumption)
-                avg = int(round(sum(consumptions) / len(consumptions))) if consumptions else 0
-                avg_str = str(avg)
-            lines.append(f"{date_str:<12} {reading:<8} {str(consumption):<8} {avg_str:<8} {unit:<5}\n")
-
-        lines.append("```\n")
-        safe_send(user_id, "".join(lines), parse_mode="MarkdownV2")
-
-    conn.close()
     send_menu(user_id)
 
+# === /export и /import — ИСТОРИЯ ФАЙЛОМ ===
+MAX_IMPORT_SIZE = 20 * 2**20  # Bot API отдаёт ботам файлы до 20 МБ
+
+@bot.message_handler(commands=['export'])
+def export_history(message):
+    user_id = message.from_user.id
+    parts = message.text.split()
+    fmt = parts[1].lower() if len(parts) > 1 else "csv"
+    if fmt not in transfer.FORMATS:
+        safe_send(user_id, "❌ Используйте `/export csv` или `/export jsonl`", parse_mode="MarkdownV2")
+        return
+
+    # Файл пишется на диск прямо из курсора, без сборки в памяти, и уходит через очередь
+    # чата — не обгонит ответы, поставленные раньше. Удаляет файл отправка
+    out = tempfile.NamedTemporaryFile("w", suffix=f".{fmt}", encoding="utf-8", newline="", delete=False)
+    try:
+        with out:
+            count = transfer.export_readings(readings.list_meters(user_id), out, fmt)
+    except Exception as e:
+        logging.error("Export error for user %s: %s", user_id, e)
+        os.remove(out.name)
+        safe_send(user_id, "❌ Не удалось выгрузить историю.")
+        return
+    if not count:
+        os.remove(out.name)
+        safe_send(user_id, "📋 Нет данных для выгрузки.")
+        return
+
+    def done(future):
+        # Заблокировавшему бота (его отключил _delivered) сообщать об ошибке незачем
+        if _delivered(user_id, future) is None and is_active_user(user_id):
+            safe_send(user_id, "❌ Не удалось выгрузить историю.")
+
+    file_name = f"meter_{datetime.now(timezone('Europe/Moscow')):%Y-%m-%d}.{fmt}"
+    outbox.call(user_id, send_document, user_id, out.name, file_name, f"Показаний: {count}").add_done_callback(done)
+
+def send_document(user_id, path, file_name, caption):
+    # Выполняется в очереди чата; имя функции — метка метрики отправки в client.Outbox
+    try:
+        with open(path, "rb") as document:
+            return bot.send_document(user_id, document, visible_file_name=file_name, caption=caption)
+    finally:
+        os.remove(path)
+
+def _import_resolver(user_id):
+    # Счётчик для строки импорта; незнакомое название при известном ресурсе —
+    # новый счётчик, так что выгрузка загружается обратно как есть. Новых счётчиков
+    # за файл не больше MAX_IMPORT_NEW_METERS, остальные названия — ошибка строки
+    meters = list(readings.list_meters(user_id))
+    created = []
+
+    def resolve(resource, name):
+        if not name:
+            return find_meter(meters, resource)[0]
+        for meter in meters:
+            if meter[2].lower() == name.lower():
+                return meter[0]
+        resource_key = RESOURCE_ALIASES.get(resource.lower())
+        if resource_key is None:
+            raise ValueError(f"неизвестный ресурс «{resource}»")
+        if len(name) > MAX_METER_NAME:
+            raise ValueError(f"название счётчика длиннее {MAX_METER_NAME} символов")
+        if len(created) >= MAX_IMPORT_NEW_METERS:
+            raise ValueError(f"неизвестный счётчик «{name}»: за один файл заводится не больше "
+                             f"{MAX_IMPORT_NEW_METERS} новых, добавьте его через /addmeter")
+        meter_id = readings.add_meter(user_id, resource_key, name)
+        if meter_id is None:
+            raise ValueError(f"счётчик «{name}» уже есть")
+        meters.append((meter_id, resource_key, name, None))
+        created.append(meter_id)
+        return meter_id
+    return resolve
+
+@bot.message_handler(commands=['import'])
+def import_help(message):
+    text = (
+        "📥 Отправьте файл .csv или .jsonl с историей показаний.\n\n"
+        "CSV — строки `ресурс,дата,показание[,счётчик]`:\n"
+        "`вода,25.11.2024,123.4,Горячая вода`\n\n"
+        "JSONL — по объекту в строке:\n"
+        "`{\"resource\": \"газ\", \"date\": \"2024-11-25\", \"meter\": 5120}`\n\n"
+        "Без названия строка относится к единственному счётчику ресурса, "
+        f"незнакомое название заводит новый счётчик (не больше {MAX_IMPORT_NEW_METERS} за файл, "
+        "остальные — через /addmeter). "
+        "Строки каждого счётчика — по возрастанию даты, показания не должны уменьшаться. "
+        "Строки, которые уже есть в истории, пропускаются — файл можно отправить повторно."
+    )
+    safe_send(message.from_user.id, text)
+
+@bot.message_handler(content_types=['document'])
+def import_document(message):
+    user_id = message.from_user.id
+    document = message.document
+    fmt = transfer.detect_format(document.file_name)
+    if fmt is None:
+        safe_send(user_id, "❌ Поддерживаются файлы .csv и .jsonl. Подробнее: /import")
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+        safe_send(user_id, "❌ Файл слишком большой (максимум 20 МБ).")
+        return
+
+    # Файл читается потоком по строкам и сразу пишется в базу пачками
+    try:
+        url = bot.get_file_url(document.file_id)
+        with requests.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            response.encoding = "utf-8"
+            result = transfer.import_readings(response.iter_lines(decode_unicode=True), fmt, _import_resolver(user_id))
+    except Exception as e:
+        logging.error("Import error for user %s: %s", user_id, e)
+        safe_send(user_id, "❌ Не удалось загрузить файл.")
+        return
+
+    lines = [f"📥 Загружено показаний: {result.total}"]
+    if result.failed is not None:
+        logging.error("Import interrupted for user %s: %s", user_id, result.failed)
+        lines.insert(0, "⚠️ Файл загружен не полностью — отправьте его ещё раз, "
+                        "уже загруженные строки будут пропущены.")
+    labels = {meter[0]: meter_label(meter) for meter in readings.list_meters(user_id)}
+    for meter_id, count in result.imported.items():
+        lines.append(f"• {labels[meter_id]}: {count}")
+    if result.skipped:
+        lines.append(f"Уже были загружены раньше: {result.skipped}")
+    if result.error_count:
+        lines.append(f"\n⚠️ Пропущено строк: {result.error_count}")
+        lines.extend(result.errors)
+    safe_send(user_id, "\n".join(lines), reply_markup=menu_keyboard(user_id))
+
 # === ЭХО-ОБРАБОТЧИК ===
 @bot.message_handler(func=lambda message: True)
 def echo_handler(message):
@@ -474,84 +1046,181 @@ def echo_handler(message):
         "🔥 Газ",
         "📆 Статистика"
     }
-    commands = {'/start', '/help', '/cancel', '/del', '/undo'}
+    commands = {'/start', '/help', '/cancel', '/del', '/undo', '/history', '/export', '/import'}
 
     if text in known_inputs or text in commands:
         return
 
     response = (
-        f"Вы написали: *{escape_markdown_v2(text)}*\n\n"
+        f"Вы написали: *{render.escape_markdown_v2(text)}*\n\n"
         f"Пожалуйста, выберите действие через меню ⬇️"
     )
-    safe_send(user_id, response, parse_mode="MarkdownV2")
-    send_menu(user_id)
+    safe_send(user_id, response, parse_mode="MarkdownV2", reply_markup=menu_keyboard(user_id))
 
 # === НАПОМИНАНИЯ ===
-scheduler = BackgroundScheduler(timezone=timezone('Europe/Moscow'))
-scheduler.start()
+scheduler = BackgroundScheduler(timezone=timezone('Europe/Moscow'))  # запускает create_app()
+
+# Telegram допускает ~30 сообщений в секунду на бота; оставляем запас
+broadcaster = broadcast.Broadcaster(
+    # Тексты рассылок экранируются один раз при постановке в очередь
+    lambda user_id, text, reply_markup: safe_send(user_id, text, reply_markup=reply_markup, escape=False,
+                                                 raise_on_flood=True, wait=True),
+    rate=float(os.getenv("BROADCAST_RATE", "25")),
+    workers=int(os.getenv("BROADCAST_WORKERS", "8")),
+)
+
+def _with_costs(recipients, text, now):
+    # Пользователям с ценами — персональный текст со стоимостью прошлого месяца;
+    # цены есть у немногих, поэтому остальные получают общий текст без запросов
+    month = (now.replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+    priced = tariffs.users_with_prices(recipients)
+    result = []
+    for user_id in recipients:
+        lines = []
+        if user_id in priced:
+            for meter in readings.list_meters(user_id):
+                cost = tariffs.monthly_costs(user_id, meter).get(month)
+                if cost is not None:
+                    lines.append(f"• {meter_label(meter)}: {cost:.2f} ₽")
+        if lines:
+            summary = f"💰 За {month[5:]}.{month[:4]}:\n" + "\n".join(lines)
+            result.append((user_id, text + "\n\n" + render.escape_markdown_v2(summary)))
+        else:
+            result.append(user_id)
+    return result
 
+@metrics.timed
 def send_monthly_reminder():
     now = datetime.now(timezone('Europe/Moscow'))
     if now.day == 1:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET remind_skipped = 0 WHERE active = 1")
-        conn.commit()
-        conn.close()
-        for user_id in remind_skipped:
-            remind_skipped[user_id] = False
+        db.execute("UPDATE users SET remind_skipped = 0 WHERE active = 1")
         logging.info("Monthly reminder flags reset.")
 
-    if has_user_entered_current_month_data():
-        return
+    recipients = _with_costs(users_to_remind(), render.REMINDER, now)
 
-    for user_id in list(active_users):
-        if remind_skipped.get(user_id, False):
-            continue
-        text = "📢 Пора ввести показания!"
-        keyboard = telebot.types.InlineKeyboardMarkup()
-        btn_t = telebot.types.InlineKeyboardButton("⏰ Напомнить завтра", callback_data="remind_tomorrow")
-        btn_d = telebot.types.InlineKeyboardButton("✅ Уже ввёл", callback_data="remind_done")
-        keyboard.add(btn_t, btn_d)
-        safe_send(user_id, text, reply_markup=keyboard)
+    # Один run_id на месяц: повторный запуск не разошлёт напоминание дважды
+    run_id = f"monthly:{now:%Y-%m}"
+    broadcaster.enqueue(run_id, recipients, render.REMINDER, render.REMINDER_KEYBOARD)
+    broadcaster.run(run_id)
 
 @bot.callback_query_handler(func=lambda call: call.data == "remind_tomorrow")
 def remind_tomorrow(call):
     user_id = call.from_user.id
     bot.answer_callback_query(call.id, "Напомню завтра!")
-    bot.edit_message_text("⏰ Напомню завтра!", call.message.chat.id, call.message.message_id)
+    safe_edit(call.message.chat.id, bot.edit_message_text, "⏰ Напомню завтра!",
+              call.message.chat.id, call.message.message_id)
     tomorrow = datetime.now(timezone('Europe/Moscow')) + timedelta(days=1)
-    scheduler.add_job(
-        lambda: send_remind_message_to_user(user_id),
-        'date',
-        run_date=tomorrow.replace(hour=9, minute=0, second=0, microsecond=0)
-    )
+    reminders.defer(user_id, tomorrow.strftime("%Y-%m-%d"))
 
-def send_remind_message_to_user(user_id):
-    if user_id not in active_users or has_user_entered_current_month_data() or remind_skipped.get(user_id, False):
+def send_deferred_reminders():
+    now = datetime.now(timezone('Europe/Moscow'))
+    today = now.strftime("%Y-%m-%d")
+    user_ids = reminders.due(today)
+    if not user_ids:
         return
-    safe_send(user_id, "📢 Напоминание: пора ввести показания!")
+    run_id = f"deferred:{today}"
+    recipients = _with_costs(users_to_remind(user_ids), render.DEFERRED_REMINDER, now)
+    broadcaster.enqueue(run_id, recipients, render.DEFERRED_REMINDER)
+    reminders.clear(today)
+    broadcaster.run(run_id)
 
 @bot.callback_query_handler(func=lambda call: call.data == "remind_done")
 def remind_done(call):
     user_id = call.from_user.id
-    remind_skipped[user_id] = True
     bot.answer_callback_query(call.id, "Спасибо!")
-    bot.edit_message_text("✅ Отлично! До следующего месяца.", call.message.chat.id, call.message.message_id)
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET remind_skipped = 1 WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    safe_edit(call.message.chat.id, bot.edit_message_text, "✅ Отлично! До следующего месяца.",
+              call.message.chat.id, call.message.message_id)
+    db.execute("UPDATE users SET remind_skipped = 1 WHERE user_id = ?", (user_id,))
+
+# === НОЧНАЯ АНАЛИТИКА: НЕОБЫЧНЫЙ РАСХОД ===
+def _format_anomaly_alert(user_id, alerts):
+    lines = ["⚠️ Необычно высокий расход:"]
+    for alert in alerts:
+        meter = readings.get_meter(alert["meter_id"])
+        unit = meter_unit(meter)
+        date_str = datetime.strptime(alert["date"], "%Y-%m-%d").strftime("%d.%m.%Y")
+        lines.append(
+            f"\n{meter_label(meter)}, показание от {date_str}:\n"
+            f"{alert['rate']:.2f} {unit} в сутки при обычных {alert['usual']:.2f}\n"
+            f"Прогноз на 30 дней: {alert['forecast'] * 30:.1f} {unit}"
+        )
+    lines.append("\nПроверьте, нет ли утечки, или исправьте показание через /del.")
+    return render.escape_markdown_v2("\n".join(lines))
+
+def send_anomaly_alerts():
+    nightly.run(broadcaster, _format_anomaly_alert,
+                workers=int(os.getenv("ANALYTICS_WORKERS", "0")) or None)
 
 # === ЗАПУСК ===
+_app_lock = threading.Lock()
+_app_ready = False
+
+def create_app():
+    # Всё, что трогает базу, сеть или запускает потоки. Повторный вызов ничего не делает.
+    # Состояние пользователей не загружается: обработчики читают его из базы по запросу
+    global _app_ready
+    with _app_lock:
+        if _app_ready:
+            return bot
+        # Асинхронно через очередь, в bot.log — JSON с ротацией и сжатием (см. logconfig.py).
+        # Токен вырезается из всех записей: его содержат URL в ошибках requests
+        logconfig.setup(secrets=(BOT_TOKEN,))
+        init_db()
+        client.keep_alive_session(SEND_WORKERS * 2)  # запас на getUpdates и прямые вызовы из обработчиков
+        scheduler.start()
+        _app_ready = True
+    return bot
+
+# Процессов бота на одной базе может быть несколько, а задачи по расписанию выполняет
+# один — владелец аренды «jobs» в state_store. Он продлевает её каждые JOBS_LEASE_RENEW
+# секунд; если процесс пропал, через JOBS_LEASE_TTL задачи переходят к другому.
+# Рассылки (resume_pending) не ограничиваются: получателей процессы делят в broadcast.py
+JOBS_LEASE_TTL = 90
+JOBS_LEASE_RENEW = 30
+JOBS_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+def owns_jobs():
+    return state_store.claim("lease", "jobs", JOBS_OWNER, JOBS_LEASE_TTL)
+
+def _jobs_owner_only(job):
+    @functools.wraps(job)
+    def run():
+        if not owns_jobs():
+            logging.info("Job %s skipped: scheduled jobs are owned by another process.", job.__name__)
+            return None
+        return job()
+    return run
+
+def start_background_jobs():
+    scheduler.add_job(owns_jobs, 'interval', seconds=JOBS_LEASE_RENEW, next_run_time=datetime.now(timezone('Europe/Moscow')))
+    scheduler.add_job(_jobs_owner_only(send_monthly_reminder), 'cron', day=10, hour=9, minute=0, timezone=timezone('Europe/Moscow'))
+    scheduler.add_job(_jobs_owner_only(send_deferred_reminders), 'cron', hour=9, minute=0, timezone=timezone('Europe/Moscow'))
+    scheduler.add_job(_jobs_owner_only(send_anomaly_alerts), 'cron', hour=3, minute=0, timezone=timezone('Europe/Moscow'))
+    scheduler.add_job(broadcaster.resume_pending)
+    scheduler.add_job(state_store.purge_expired, 'interval', hours=1)
+    # Обслуживание базы — после ночной аналитики, в самые тихие часы
+    scheduler.add_job(_jobs_owner_only(maintenance.run), 'cron', hour=4, minute=30, timezone=timezone('Europe/Moscow'))
+    if os.getenv("METRICS_PORT"):
+        metrics.serve(int(os.getenv("METRICS_PORT")), os.getenv("METRICS_HOST", "127.0.0.1"))
+    atexit.register(_shutdown)
+
+def _shutdown():
+    # Сначала то, что ставит работу (задачи планировщика ждём до конца), затем очереди
+    # отправки — досылаем, пока база открыта, и только потом закрываем соединения
+    scheduler.shutdown()
+    charts.shutdown()
+    broadcaster.close()
+    outbox.close()
+    db.close_all()
+
 if __name__ == '__main__':
-    scheduler.add_job(send_monthly_reminder, 'cron', day=10, hour=9, minute=0, timezone=timezone('Europe/Moscow'))
+    create_app()
+    start_background_jobs()
     logging.info("Bot started. Awaiting messages.")
-    atexit.register(lambda: scheduler.shutdown())
     while True:
         try:
-            bot.polling(none_stop=True, interval=1, timeout=20)
+            # Long polling сам ждёт обновлений до timeout; пауза между запросами только добавляла задержку
+            bot.polling(none_stop=True, interval=0, timeout=20)
         except Exception as e:
             logging.error("Polling error: %s", e)
             time.sleep(5)
@@ -0,0 +1,255 @@
+import bisect
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import logconfig
+
+# === МЕТРИКИ В ФОРМАТЕ PROMETHEUS ===
+# Счётчики и гистограммы живут в памяти процесса; serve() отдаёт их текстом
+# на /metrics. Модуль не зависит от остального бота, чтобы его мог импортировать db.py.
+
+SLOW_HANDLER_SECONDS = float(os.getenv("SLOW_HANDLER_SECONDS", "1.0"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(labelnames, values):
+    if not labelnames:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_label_text(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счётчики по корзинам..., +Inf], сумма
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _samples(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            labels = _label_text(self.labelnames + ("le",), key + (le,))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _label_text(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# === МЕТРИКИ БОТА ===
+HANDLER_SECONDS = Histogram("meter_handler_seconds", "Handler latency.", ("handler",))
+HANDLER_ERRORS = Counter("meter_handler_errors_total", "Handler exceptions.", ("handler",))
+DB_SECONDS = Histogram("meter_db_seconds", "SQLite call latency.", ("op",), DB_BUCKETS)
+DB_LOCK_WAIT_SECONDS = Histogram("meter_db_lock_wait_seconds", "Wait for the write lock.", (), DB_BUCKETS)
+TELEGRAM_SECONDS = Histogram("meter_telegram_seconds", "Telegram API call latency.", ("method",))
+TELEGRAM_ERRORS = Counter("meter_telegram_errors_total", "Telegram API errors by code.", ("method", "code"))
+BROADCAST_MESSAGES = Counter("meter_broadcast_messages_total", "Broadcast deliveries.", ("kind", "status"))
+BROADCAST_FLOOD_WAITS = Counter("meter_broadcast_flood_waits_total", "429 pauses during broadcasts.")
+BROADCAST_RATE = Gauge("meter_broadcast_rate", "Messages per second of the last finished broadcast.", ("kind",))
+DB_SIZE_BYTES = Gauge("meter_db_size_bytes", "Database file size after the last maintenance run.")
+MAINTENANCE_SECONDS = Gauge("meter_maintenance_seconds", "Duration of the last maintenance run by step.", ("step",))
+
+
+# === ВЫБОРОЧНОЕ ПРОФИЛИРОВАНИЕ ===
+# PROFILE_HANDLERS — имена обработчиков через запятую (или *), PROFILE_SAMPLE — доля
+# вызовов под cProfile. Статистика копится по обработчику и видна на /profile/<имя>.
+PROFILE_HANDLERS = {name.strip() for name in os.getenv("PROFILE_HANDLERS", "").split(",") if name.strip()}
+PROFILE_SAMPLE = float(os.getenv("PROFILE_SAMPLE", "0.01"))
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+_profiling = threading.local()
+
+
+def _should_profile(name):
+    # cProfile не вкладывается: профилируем только внешний вызов в потоке
+    if getattr(_profiling, "active", False):
+        return False
+    if name not in PROFILE_HANDLERS and "*" not in PROFILE_HANDLERS:
+        return False
+    return random.random() < PROFILE_SAMPLE
+
+def _profiled_call(name, func, args, kwargs):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # С Python 3.12 профилировщик один на процесс — этот вызов пропускаем
+        return func(*args, **kwargs)
+    _profiling.active = True
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        _profiling.active = False
+        with _profiles_lock:
+            if name in _profiles:
+                _profiles[name].add(profiler)
+            else:
+                _profiles[name] = pstats.Stats(profiler)
+
+def profile_report(name, limit=30):
+    with _profiles_lock:
+        stats = _profiles.get(name)
+        if stats is None:
+            return None
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+def _user_id(args):
+    # Первый аргумент обработчика — message или call
+    user = getattr(args[0], "from_user", None) if args else None
+    return getattr(user, "id", None)
+
+def timed(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        with logconfig.context(handler=name, user_id=_user_id(args)):
+            try:
+                if PROFILE_HANDLERS and _should_profile(name):
+                    return _profiled_call(name, func, args, kwargs)
+                return func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                duration = time.perf_counter() - started
+                HANDLER_SECONDS.observe(duration, handler=name)
+                if duration > SLOW_HANDLER_SECONDS:
+                    logging.warning("Slow handler %s: %.3fs", name, duration, extra={"duration": round(duration, 3)})
+    return wrapper
+
+
+# === HTTP: /metrics и /profile/<обработчик> ===
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = render(), "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.startswith("/profile/"):
+            report = profile_report(self.path[len("/profile/"):])
+            if report is None:
+                self.send_error(404)
+                return
+            body, content_type = report, "text/plain; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info("Metrics available at http://%s:%s/metrics", host, port)
+    return server
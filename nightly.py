@@ -0,0 +1,171 @@
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import analytics
+import db
+
+# === НОЧНОЙ РАСЧЁТ АНОМАЛИЙ И ПРОГНОЗА ===
+# За один запуск обрабатываются только счётчики с новыми показаниями: для каждого
+# счётчика хранится водяной знак — id последнего обработанного показания, а строка
+# с meter_id = 0 хранит общий максимум id, так что поиск новых показаний — диапазон
+# по первичному ключу, а не проход по всей истории.
+# История для контекста читается окном HISTORY_DAYS пачками счётчиков и
+# считается в пуле процессов.
+
+HISTORY_DAYS = 365
+ALERT_DAYS = 31  # о старых аномалиях (например, из импорта) не сообщаем
+FORECAST_DAYS = 90  # по скольким последним дням считается прогноз
+CHUNK_METERS = 500
+GLOBAL = 0
+
+
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_watermark (
+            meter_id INTEGER PRIMARY KEY,
+            last_id INTEGER NOT NULL
+        )
+    ''')
+
+def mark_all_processed(cursor):
+    # Все уже внесённые показания считаются проверенными (после переноса данных)
+    cursor.execute('''
+        INSERT OR REPLACE INTO analytics_watermark (meter_id, last_id)
+        SELECT meter_id, MAX(id) FROM readings GROUP BY meter_id
+    ''')
+    cursor.execute(
+        "INSERT OR REPLACE INTO analytics_watermark (meter_id, last_id) SELECT ?, COALESCE(MAX(id), 0) FROM readings",
+        (GLOBAL,)
+    )
+
+
+def _watermark(meter_id=GLOBAL):
+    row = db.fetchone("SELECT last_id FROM analytics_watermark WHERE meter_id = ?", (meter_id,))
+    return row[0] if row else 0
+
+def _new_readings():
+    # (meter_id, user_id, max id) для счётчиков активных пользователей с показаниями новее общего водяного знака
+    return db.fetchall('''
+        SELECT r.meter_id, m.user_id, MAX(r.id)
+        FROM readings r
+        JOIN meters m ON m.meter_id = r.meter_id
+        JOIN users u ON u.user_id = m.user_id AND u.active = 1
+        WHERE r.id > ?
+        GROUP BY r.meter_id
+    ''', (_watermark(),))
+
+def _load_chunk(meter_ids, since):
+    rows = db.iterate('''
+        SELECT meter_id, id, date, value FROM readings
+        WHERE meter_id IN (SELECT value FROM json_each(?)) AND date >= ?
+        ORDER BY meter_id, date
+    ''', (json.dumps(meter_ids), since))
+    keys, ids, dates, values = [], [], [], []
+    for meter_id, row_id, date_db, value in rows:
+        keys.append(meter_id)
+        ids.append(row_id)
+        dates.append(date_db)
+        values.append(value)
+    return keys, ids, dates, values
+
+
+# === РАСЧЁТ В ПРОЦЕССЕ-ИСПОЛНИТЕЛЕ ===
+def analyze_chunk(keys, ids, dates, values, watermarks, today):
+    # Возвращает (meter_id, день, расход в сутки, обычный расход, прогноз в сутки)
+    # для новых (id > водяного знака) недавних аномально высоких показаний
+    if not keys:
+        return []
+    meters, seg, days, values = analytics.series_from_rows(list(zip(keys, dates, values)))
+    ids = np.asarray(ids, dtype=np.int64)
+    _, _, rate = analytics.intervals(seg, days, values)
+    flags = analytics.anomalies(seg, rate)
+
+    known = ~np.isnan(rate)
+    normal = known & ~flags["flag"]
+    count = np.bincount(seg[normal], minlength=len(meters))
+    usual = np.bincount(seg[normal], weights=rate[normal], minlength=len(meters)) / np.maximum(count, 1)
+    # Прогноз — по фактическому недавнему расходу: если утечка продолжается, он её учитывает
+    recent = known & (days >= today - FORECAST_DAYS)
+    recent_count = np.bincount(seg[recent], minlength=len(meters))
+    forecast = np.where(
+        recent_count > 0,
+        np.bincount(seg[recent], weights=rate[recent], minlength=len(meters)) / np.maximum(recent_count, 1),
+        usual,
+    )
+
+    watermark = np.asarray([watermarks.get(int(meter_id), 0) for meter_id in meters], dtype=np.int64)
+    fresh = (ids > watermark[seg]) & (days >= today - ALERT_DAYS)
+    hits = np.flatnonzero(flags["flag"] & (flags["z"] > 0) & fresh)
+    return [
+        (int(meters[seg[i]]), int(days[i]), float(rate[i]), float(usual[seg[i]]), float(forecast[seg[i]]))
+        for i in hits
+    ]
+
+
+# === ЗАПУСК ===
+def run(broadcaster, render, workers=None):
+    # render(user_id, alerts) -> текст; alerts — словари meter_id/date/rate/usual/forecast
+    started = time.monotonic()
+    today = datetime.now().date()
+    today_day = int(np.datetime64(today, "D").astype(np.int64))
+    since = str(np.datetime64(today, "D") - HISTORY_DAYS)
+
+    candidates = _new_readings()
+    owners = {meter_id: user_id for meter_id, user_id, _ in candidates}
+    alerts = {}
+
+    def collect(future):
+        for meter_id, day, rate, usual, forecast in future.result():
+            alerts.setdefault(owners[meter_id], []).append({
+                "meter_id": meter_id,
+                "date": str(np.datetime64(day, "D")),
+                "rate": rate,
+                "usual": usual,
+                "forecast": forecast,
+            })
+
+    if candidates:
+        watermarks = dict(db.fetchall(
+            "SELECT meter_id, last_id FROM analytics_watermark WHERE meter_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(owners)),)
+        ))
+        workers = workers or os.cpu_count() or 1
+        # forkserver: расчёт идёт из потока планировщика, и fork копировал бы процесс
+        # бота с чужими потоками и замками. Импорт главного модуля в исполнителе ничего
+        # не запускает (см. charts._get_pool). Исполнитель не трогает базу — только считает массивы.
+        context = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            # Не больше 2 пачек на исполнителя в полёте — память не растёт с числом счётчиков
+            in_flight = deque()
+            for offset in range(0, len(candidates), CHUNK_METERS):
+                chunk = [meter_id for meter_id, _, _ in candidates[offset:offset + CHUNK_METERS]]
+                keys, ids, dates, values = _load_chunk(chunk, since)
+                chunk_marks = {meter_id: watermarks.get(meter_id, 0) for meter_id in chunk}
+                in_flight.append(pool.submit(analyze_chunk, keys, ids, dates, values, chunk_marks, today_day))
+                if len(in_flight) >= 2 * workers:
+                    collect(in_flight.popleft())
+            while in_flight:
+                collect(in_flight.popleft())
+
+    run_id = f"anomaly:{today}"
+    if alerts:
+        broadcaster.enqueue(run_id, [(user_id, render(user_id, items)) for user_id, items in alerts.items()], "")
+    # Водяные знаки сдвигаются только после того, как уведомления поставлены в очередь
+    new_marks = [(meter_id, last_id) for meter_id, _, last_id in candidates]
+    if candidates:
+        new_marks.append((GLOBAL, max(last_id for _, _, last_id in candidates)))
+    db.executemany("INSERT OR REPLACE INTO analytics_watermark (meter_id, last_id) VALUES (?, ?)", new_marks)
+    duration = time.monotonic() - started
+    logging.info("Nightly analytics: %s meter series processed, %s users alerted in %.1fs.",
+                 len(candidates), len(alerts), duration, extra={"duration": round(duration, 3)})
+    if alerts:
+        broadcaster.run(run_id)
+    return alerts
@@ -0,0 +1,278 @@
+import json
+
+import db
+
+# Счётчики пользователей — таблица meters: meter_id (короткий целый ключ),
+# resource — вид ресурса (electricity, water, gas), name — название в меню,
+# tariff — тарифная зона (NULL — однотарифный, day / night — зоны электросчётчика).
+# Показания всех счётчиков — одна таблица readings с накопительными агрегатами:
+#   delta     — расход с предыдущего показания (NULL у первого),
+#   run_count — число интервалов до этого показания включительно,
+#   run_sum   — суммарный расход до этого показания включительно.
+# Индекс (meter_id, date, value) покрывает поиск последнего показания, проверку
+# даты и выгрузку: такие запросы читают только индекс и только свой счётчик.
+# Уникальный индекс (meter_id, date) не даёт внести два показания на одну дату.
+# Помесячные итоги лежат в monthly_totals (расход относится к месяцу более позднего показания).
+# Показания до archive_bounds.before перенесены в холодный архив (см. maintenance.py):
+# онлайн остаётся последнее из них как опора, итоги архивных месяцев не пересчитываются.
+
+
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meters (
+            meter_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            resource TEXT NOT NULL,
+            name TEXT NOT NULL,
+            tariff TEXT
+        )
+    ''')
+    # Название уникально у пользователя: по нему кнопка меню и /del находят счётчик
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_meters_user_name ON meters (user_id, name)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS readings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            meter_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            value REAL NOT NULL,
+            delta REAL,
+            run_count INTEGER NOT NULL DEFAULT 0,
+            run_sum REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_readings_meter_date ON readings (meter_id, date, value)")
+    # Уникальный idx_readings_meter_day (одно показание на счётчик в день) создаёт
+    # миграция v5 в meter.py: сначала она убирает дубли, накопленные старыми базами
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_totals (
+            meter_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            consumption REAL NOT NULL,
+            readings INTEGER NOT NULL,
+            PRIMARY KEY (meter_id, month)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive_bounds (
+            meter_id INTEGER PRIMARY KEY,
+            before TEXT NOT NULL
+        )
+    ''')
+
+
+# === СЧЁТЧИКИ ===
+# Строка счётчика: (meter_id, resource, name, tariff)
+def ensure_meters(user_id, defaults, cursor=None):
+    # defaults — пары (resource, name); уже заведённые счётчики не трогаются
+    rows = [(user_id, resource, name) for resource, name in defaults]
+    sql = "INSERT OR IGNORE INTO meters (user_id, resource, name) VALUES (?, ?, ?)"
+    if cursor is not None:
+        cursor.executemany(sql, rows)
+    else:
+        db.executemany(sql, rows)
+
+def add_meter(user_id, resource, name, tariff=None):
+    # Возвращает meter_id нового счётчика или None, если название уже занято
+    with db.transaction() as cursor:
+        cursor.execute(
+            "INSERT OR IGNORE INTO meters (user_id, resource, name, tariff) VALUES (?, ?, ?, ?)",
+            (user_id, resource, name, tariff)
+        )
+        return cursor.lastrowid if cursor.rowcount else None
+
+def list_meters(user_id):
+    return db.fetchall(
+        "SELECT meter_id, resource, name, tariff FROM meters WHERE user_id = ? ORDER BY meter_id", (user_id,)
+    )
+
+def get_meter(meter_id, user_id=None):
+    # С user_id — только если счётчик принадлежит этому пользователю
+    if user_id is None:
+        return db.fetchone("SELECT meter_id, resource, name, tariff FROM meters WHERE meter_id = ?", (meter_id,))
+    return db.fetchone(
+        "SELECT meter_id, resource, name, tariff FROM meters WHERE meter_id = ? AND user_id = ?", (meter_id, user_id)
+    )
+
+
+# === ЧТЕНИЕ ===
+def find_reading(meter_id, date_db):
+    row = db.fetchone("SELECT value FROM readings WHERE meter_id = ? AND date = ?", (meter_id, date_db))
+    return row[0] if row else None
+
+def latest_reading(meter_id):
+    row = db.fetchone("SELECT value FROM readings WHERE meter_id = ? ORDER BY date DESC LIMIT 1", (meter_id,))
+    return row[0] if row else None
+
+def has_reading_on(meter_id, date_db):
+    return db.fetchone("SELECT 1 FROM readings WHERE meter_id = ? AND date = ? LIMIT 1", (meter_id, date_db)) is not None
+
+def neighbours(meter_id, date_db):
+    # Показания по обе стороны от date_db: (предыдущее, следующее), None — если нет
+    before = db.fetchone(
+        "SELECT value FROM readings WHERE meter_id = ? AND date < ? ORDER BY date DESC LIMIT 1", (meter_id, date_db)
+    )
+    after = db.fetchone(
+        "SELECT value FROM readings WHERE meter_id = ? AND date > ? ORDER BY date ASC LIMIT 1", (meter_id, date_db)
+    )
+    return (before[0] if before else None), (after[0] if after else None)
+
+def users_without_readings_since(date_db, user_ids=None):
+    # Один запрос на всех: активные пользователи без пропуска напоминания,
+    # у которых ни по одному счётчику нет показаний начиная с date_db.
+    # Для каждого счётчика — поиск по индексу (meter_id, date).
+    sql = '''
+        SELECT u.user_id FROM users u
+        WHERE u.active = 1 AND u.remind_skipped = 0 AND NOT EXISTS (
+            SELECT 1 FROM meters m JOIN readings r ON r.meter_id = m.meter_id
+            WHERE m.user_id = u.user_id AND r.date >= :since
+        )
+    '''
+    params = {"since": date_db}
+    if user_ids is not None:
+        sql += " AND u.user_id IN (SELECT value FROM json_each(:user_ids))"
+        params["user_ids"] = json.dumps(list(user_ids))
+    return [row[0] for row in db.fetchall(sql, params)]
+
+def archived_before(meter_id):
+    # Граница архива счётчика (первый день онлайн-месяца) или None
+    row = db.fetchone("SELECT before FROM archive_bounds WHERE meter_id = ?", (meter_id,))
+    return row[0] if row else None
+
+def month_consumption_before(meter_id, date_db):
+    # Расход с начала месяца date_db до этой даты — для ступенчатых тарифов
+    row = db.fetchone(
+        "SELECT COALESCE(SUM(delta), 0) FROM readings WHERE meter_id = ? AND date >= ? AND date < ?",
+        (meter_id, date_db[:7] + "-01", date_db)
+    )
+    return row[0]
+
+def bounds(meter_id):
+    # Первое и последнее показание: (first_date, first_value, last_date, last_value) или None
+    first = db.fetchone("SELECT date, value FROM readings WHERE meter_id = ? ORDER BY date ASC LIMIT 1", (meter_id,))
+    if first is None:
+        return None
+    last = db.fetchone("SELECT date, value FROM readings WHERE meter_id = ? ORDER BY date DESC LIMIT 1", (meter_id,))
+    return first + last
+
+def version(meter_id):
+    # (последний id, число показаний): меняется при любой вставке или удалении,
+    # id не переиспользуются (AUTOINCREMENT)
+    return db.fetchone("SELECT MAX(id), COUNT(*) FROM readings WHERE meter_id = ?", (meter_id,))
+
+def monthly_totals(meter_id):
+    return db.fetchall("SELECT month, consumption FROM monthly_totals WHERE meter_id = ? ORDER BY month", (meter_id,))
+
+def iter_readings(meter_id):
+    return db.iterate("SELECT date, value FROM readings WHERE meter_id = ? ORDER BY date ASC", (meter_id,))
+
+# Строки истории: (date, value, delta, avg) — всё уже посчитано при записи
+def _history_row(row):
+    date_db, value, delta, run_count, run_sum = row
+    return date_db, value, delta, run_sum / run_count if run_count else None
+
+def iter_history(meter_id):
+    rows = db.iterate(
+        "SELECT date, value, delta, run_count, run_sum FROM readings WHERE meter_id = ? ORDER BY date ASC",
+        (meter_id,)
+    )
+    return map(_history_row, rows)
+
+def history_page(meter_id, limit, before=None, after=None):
+    # Keyset-пагинация по дате: читаем limit + 1 строк, чтобы узнать, есть ли ещё
+    columns = "date, value, delta, run_count, run_sum"
+    if after is not None:
+        rows = db.fetchall(
+            f"SELECT {columns} FROM readings WHERE meter_id = ? AND date > ? ORDER BY date ASC LIMIT ?",
+            (meter_id, after, limit + 1)
+        )
+        has_newer = len(rows) > limit
+        rows = rows[:limit]
+        has_older = True
+    else:
+        if before is not None:
+            rows = db.fetchall(
+                f"SELECT {columns} FROM readings WHERE meter_id = ? AND date < ? ORDER BY date DESC LIMIT ?",
+                (meter_id, before, limit + 1)
+            )
+            has_newer = True
+        else:
+            rows = db.fetchall(
+                f"SELECT {columns} FROM readings WHERE meter_id = ? ORDER BY date DESC LIMIT ?",
+                (meter_id, limit + 1)
+            )
+            has_newer = False
+        has_older = len(rows) > limit
+        rows = rows[:limit][::-1]
+    return [_history_row(row) for row in rows], has_older, has_newer
+
+
+# === ЗАПИСЬ ===
+def insert_reading(meter_id, value, date_db):
+    # False — на эту дату показание уже есть (например, внесено параллельно)
+    with db.transaction() as cursor:
+        cursor.execute("INSERT OR IGNORE INTO readings (meter_id, value, date) VALUES (?, ?, ?)", (meter_id, value, date_db))
+        if not cursor.rowcount:
+            return False
+        update_rollup(cursor, meter_id, date_db)
+    return True
+
+def insert_many(meter_id, rows):
+    # rows — пары (value, date); агрегаты пересчитывает refresh_rollup после загрузки
+    with db.transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO readings (meter_id, value, date) VALUES (?, ?, ?)",
+            [(meter_id, value, date_db) for value, date_db in rows]
+        )
+
+def refresh_rollup(meter_id, from_date):
+    with db.transaction() as cursor:
+        update_rollup(cursor, meter_id, from_date)
+
+def delete_reading(meter_id, date_db, value):
+    with db.transaction() as cursor:
+        # Опорное показание архива не удаляется: от него считается расход онлайн-истории
+        cursor.execute("SELECT 1 FROM archive_bounds WHERE meter_id = ? AND before > ?", (meter_id, date_db))
+        if cursor.fetchone():
+            return 0
+        cursor.execute("DELETE FROM readings WHERE meter_id = ? AND date = ? AND value = ?", (meter_id, date_db, value))
+        deleted = cursor.rowcount
+        if deleted:
+            update_rollup(cursor, meter_id, date_db)
+    return deleted
+
+
+# === НАКОПИТЕЛЬНЫЕ АГРЕГАТЫ ===
+def update_rollup(cursor, meter_id, from_date):
+    # Пересчитываются только показания начиная с from_date: для нового показания
+    # за сегодня это одна строка, для удаления/восстановления — хвост истории.
+    cursor.execute(
+        "SELECT value, run_count, run_sum FROM readings WHERE meter_id = ? AND date < ? ORDER BY date DESC LIMIT 1",
+        (meter_id, from_date)
+    )
+    prev = cursor.fetchone()
+    cursor.execute("SELECT id, value FROM readings WHERE meter_id = ? AND date >= ? ORDER BY date ASC", (meter_id, from_date))
+    updates = []
+    for row_id, value in cursor.fetchall():
+        if prev is None:
+            updates.append((None, 0, 0.0, row_id))
+        else:
+            prev_value, run_count, run_sum = prev
+            delta = value - prev_value
+            updates.append((delta, run_count + 1, run_sum + delta, row_id))
+        prev = (value, updates[-1][1], updates[-1][2])
+    cursor.executemany("UPDATE readings SET delta = ?, run_count = ?, run_sum = ? WHERE id = ?", updates)
+
+    month_start = from_date[:7] + "-01"
+    cursor.execute("SELECT before FROM archive_bounds WHERE meter_id = ?", (meter_id,))
+    bound = cursor.fetchone()
+    if bound and bound[0] > month_start:
+        # Показаний архивных месяцев онлайн нет — их итоги остаются как есть
+        month_start = bound[0]
+    cursor.execute("DELETE FROM monthly_totals WHERE meter_id = ? AND month >= ?", (meter_id, month_start[:7]))
+    cursor.execute('''
+        INSERT INTO monthly_totals (meter_id, month, consumption, readings)
+        SELECT meter_id, substr(date, 1, 7), SUM(delta), COUNT(*)
+        FROM readings
+        WHERE meter_id = ? AND date >= ? AND delta IS NOT NULL
+        GROUP BY substr(date, 1, 7)
+    ''', (meter_id, month_start))
@@ -0,0 +1,25 @@
+import db
+
+# === ОТЛОЖЕННЫЕ НАПОМИНАНИЯ ===
+# «Напомнить завтра» — строка (день, пользователь) в базе вместо отдельной
+# задачи планировщика: переживает перезапуск, повторные нажатия не дублируются,
+# а все напоминания дня отправляет одна пакетная задача.
+
+
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS deferred_reminders (
+            remind_on TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (remind_on, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+def defer(user_id, remind_on):
+    db.execute("INSERT OR IGNORE INTO deferred_reminders (remind_on, user_id) VALUES (?, ?)", (remind_on, user_id))
+
+def due(day):
+    return [row[0] for row in db.fetchall("SELECT DISTINCT user_id FROM deferred_reminders WHERE remind_on <= ?", (day,))]
+
+def clear(day):
+    return db.execute("DELETE FROM deferred_reminders WHERE remind_on <= ?", (day,))
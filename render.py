@@ -0,0 +1,70 @@
+import json
+import string
+
+# === ОТРИСОВКА СООБЩЕНИЙ ===
+# Всё, что не зависит от пользователя, готовится один раз при импорте:
+# таблица экранирования MarkdownV2, статичные клавиатуры в виде готового JSON
+# (telebot передаёт строку reply_markup как есть) и шаблоны частых сообщений
+# с заранее экранированной статичной частью.
+
+MARKDOWN_V2_SPECIAL = '_*[]()~`>#+-=|{}.!'
+_ESCAPE_TABLE = str.maketrans({char: "\\" + char for char in MARKDOWN_V2_SPECIAL})
+
+
+def escape_markdown_v2(text):
+    return text.translate(_ESCAPE_TABLE)
+
+# Внутри блока ``` экранируются только ` и \
+def escape_code_v2(text):
+    return text.replace('\\', '\\\\').replace('`', '\\`')
+
+
+# === ШАБЛОНЫ ===
+class Template:
+    # Текст шаблона экранируется при создании, подставляемые значения — в format()
+    def __init__(self, fmt):
+        self._parts = [
+            (escape_markdown_v2(literal), field, spec)
+            for literal, field, spec, _ in string.Formatter().parse(fmt)
+        ]
+
+    def format(self, **values):
+        out = []
+        for literal, field, spec in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(escape_markdown_v2(format(values[field], spec)))
+        return "".join(out)
+
+
+MENU_PROMPT = escape_markdown_v2("Выберите действие через меню:")
+ENTER_READING = Template("Введите показания счётчика {resource}:")
+SAVED = Template("✅ Показания сохранены: {value} {unit}")
+CONSUMPTION = Template("💡 Расход с прошлого раза: {consumption} {unit}")
+FIRST_READING = escape_markdown_v2("🆕 Это первое показание — нет данных для сравнения.")
+ALREADY_TODAY = escape_markdown_v2("⚠️ Показания на сегодня уже внесены!")
+NOT_A_NUMBER = escape_markdown_v2("❌ Ошибка: введите корректное число!")
+DELETED = Template("✅ Запись удалена:\n*{name}*, дата: {date}, показания: {value}")
+RESTORED = Template("✅ Восстановлено:\n*{name}*, дата: {date}, показания: {value}")
+REMINDER = escape_markdown_v2("📢 Пора ввести показания!")
+DEFERRED_REMINDER = escape_markdown_v2("📢 Напоминание: пора ввести показания!")
+
+
+# === КЛАВИАТУРЫ ===
+def reply_keyboard(rows, resize=True):
+    return json.dumps(
+        {"keyboard": [[{"text": text} for text in row] for row in rows], "resize_keyboard": resize},
+        ensure_ascii=False
+    )
+
+def inline_keyboard(rows):
+    # rows — списки пар (текст, callback_data)
+    return json.dumps(
+        {"inline_keyboard": [[{"text": text, "callback_data": data} for text, data in row] for row in rows]},
+        ensure_ascii=False
+    )
+
+REMINDER_KEYBOARD = inline_keyboard([[("⏰ Напомнить завтра", "remind_tomorrow"), ("✅ Уже ввёл", "remind_done")]])
+
+def delete_keyboard(meter_id, date_db, meter_value):
+    return inline_keyboard([[("✅ Да", f"confirm_delete:{meter_id}:{date_db}:{meter_value}"), ("❌ Нет", "cancel_delete")]])
@@ -0,0 +1,155 @@
+import abc
+import json
+import threading
+import time
+
+import db
+
+# === ХРАНИЛИЩЕ СОСТОЯНИЯ ДИАЛОГОВ ===
+# Состояние пользователя (ожидаемый ввод, последнее удаление для /undo) хранится
+# по (namespace, key) с необязательным TTL. Бэкенд sqlite общий для всех
+# процессов бота и переживает перезапуск; memory — для одного процесса.
+# Значения должны сериализоваться в JSON. claim — аренда: ключ достаётся одному
+# владельцу, пока тот продлевает её чаще, чем раз в ttl секунд.
+
+
+class StateStore(abc.ABC):
+    @abc.abstractmethod
+    def get(self, namespace, key, default=None):
+        ...
+
+    @abc.abstractmethod
+    def set(self, namespace, key, value, ttl=None):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, namespace, key):
+        ...
+
+    @abc.abstractmethod
+    def pop(self, namespace, key, default=None):
+        ...
+
+    @abc.abstractmethod
+    def claim(self, namespace, key, owner, ttl):
+        ...
+
+    def purge_expired(self):
+        return 0
+
+
+class MemoryStateStore(StateStore):
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, namespace, key, now):
+        item = self._data.get((namespace, str(key)))
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[(namespace, str(key))]
+            return None
+        return item
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            item = self._live(namespace, key, time.time())
+        return default if item is None else json.loads(item[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[(namespace, str(key))] = (json.dumps(value), expires_at)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, str(key)), None)
+
+    def pop(self, namespace, key, default=None):
+        with self._lock:
+            item = self._live(namespace, key, time.time())
+            if item is not None:
+                del self._data[(namespace, str(key))]
+        return default if item is None else json.loads(item[0])
+
+    def claim(self, namespace, key, owner, ttl):
+        now = time.time()
+        with self._lock:
+            item = self._live(namespace, key, now)
+            if item is not None and json.loads(item[0]) != owner:
+                return False
+            self._data[(namespace, str(key))] = (json.dumps(owner), now + ttl)
+        return True
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [k for k, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]
+            for k in expired:
+                del self._data[k]
+        return len(expired)
+
+
+class SQLiteStateStore(StateStore):
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS state (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+        ''')
+
+    def get(self, namespace, key, default=None):
+        row = db.fetchone(
+            "SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, str(key), time.time())
+        )
+        return default if row is None else json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        db.execute(
+            "INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, str(key), json.dumps(value), expires_at)
+        )
+
+    def delete(self, namespace, key):
+        db.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, str(key)))
+
+    def pop(self, namespace, key, default=None):
+        with db.transaction() as cursor:
+            cursor.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, str(key), time.time())
+            )
+            row = cursor.fetchone()
+            cursor.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, str(key)))
+        return default if row is None else json.loads(row[0])
+
+    def claim(self, namespace, key, owner, ttl):
+        # Одной записью: занять свободный или просроченный ключ либо продлить свой
+        now = time.time()
+        return db.execute('''
+            INSERT INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+            WHERE state.value = excluded.value OR state.expires_at <= ?
+        ''', (namespace, str(key), json.dumps(owner), now + ttl, now)) > 0
+
+    def purge_expired(self):
+        return db.execute("DELETE FROM state WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+
+BACKENDS = {
+    "memory": MemoryStateStore,
+    "sqlite": SQLiteStateStore,
+}
+
+def create_store(backend="sqlite"):
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд состояния: {backend}")
+    return BACKENDS[backend]()
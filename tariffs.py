@@ -0,0 +1,161 @@
+import bisect
+import functools
+import json
+
+import db
+import readings
+
+# === ТАРИФЫ ===
+# Цена действует с даты valid_from до следующей цены той же области. Область —
+# конкретный счётчик или весь ресурс пользователя (для электричества — ещё и зона
+# day/night, см. meters.tariff). tiers — ступени по расходу за месяц:
+# [[до, цена], ..., [null, цена]]; однотарифная цена — [[null, цена]].
+# Расход интервала относится к дате более позднего показания, как в monthly_totals.
+# Цены пользователя загружаются одним запросом в индекс интервалов (даты начала
+# по областям, поиск — bisect), индекс кэшируется по версии тарифов.
+
+ANY_ZONE = ""
+ANY_METER = 0
+INDEX_CACHE_SIZE = 4096
+COSTS_CACHE_SIZE = 16384
+
+
+def create_tables(cursor):
+    # Пустая зона и meter_id = 0 вместо NULL — чтобы уникальный индекс различал области
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tariffs (
+            tariff_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            resource TEXT NOT NULL,
+            zone TEXT NOT NULL DEFAULT '',
+            meter_id INTEGER NOT NULL DEFAULT 0,
+            valid_from TEXT NOT NULL,
+            tiers TEXT NOT NULL
+        )
+    ''')
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_tariffs_scope ON tariffs (user_id, resource, zone, meter_id, valid_from)"
+    )
+
+
+def set_price(user_id, resource, tiers, valid_from, zone=ANY_ZONE, meter_id=ANY_METER):
+    # Та же область и дата — цена заменяется (новый tariff_id меняет версию)
+    db.execute(
+        "INSERT OR REPLACE INTO tariffs (user_id, resource, zone, meter_id, valid_from, tiers) VALUES (?, ?, ?, ?, ?, ?)",
+        (user_id, resource, zone, meter_id, valid_from, json.dumps(tiers))
+    )
+
+def list_prices(user_id):
+    return [
+        (resource, zone, meter_id, valid_from, json.loads(tiers))
+        for resource, zone, meter_id, valid_from, tiers in db.fetchall(
+            "SELECT resource, zone, meter_id, valid_from, tiers FROM tariffs WHERE user_id = ? "
+            "ORDER BY resource, meter_id, zone, valid_from",
+            (user_id,)
+        )
+    ]
+
+def users_with_prices(user_ids):
+    return {row[0] for row in db.fetchall(
+        "SELECT DISTINCT user_id FROM tariffs WHERE user_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(user_ids)),)
+    )}
+
+def version(user_id):
+    # Как readings.version: tariff_id не переиспользуются, замена цены даёт новый id
+    return db.fetchone("SELECT MAX(tariff_id), COUNT(*) FROM tariffs WHERE user_id = ?", (user_id,))
+
+
+# === ИНДЕКС ИНТЕРВАЛОВ ЦЕН ===
+class PriceIndex:
+    def __init__(self, rows):
+        # rows — (resource, zone, meter_id, valid_from, tiers) по возрастанию valid_from
+        self._scopes = {}
+        for resource, zone, meter_id, valid_from, tiers in rows:
+            starts, values = self._scopes.setdefault((resource, zone, meter_id), ([], []))
+            starts.append(valid_from)
+            values.append(tiers)
+
+    def _candidates(self, meter):
+        # Своя цена счётчика важнее цены зоны, цена зоны — общей цены ресурса
+        meter_id, resource, _, zone = meter
+        keys = [(resource, ANY_ZONE, meter_id)]
+        if zone:
+            keys.append((resource, zone, ANY_METER))
+        keys.append((resource, ANY_ZONE, ANY_METER))
+        return [self._scopes[key] for key in keys if key in self._scopes]
+
+    def covers(self, meter):
+        return bool(self._candidates(meter))
+
+    def tiers(self, meter, date_db):
+        for starts, values in self._candidates(meter):
+            i = bisect.bisect_right(starts, date_db) - 1
+            if i >= 0:
+                return values[i]
+        return None
+
+
+@functools.lru_cache(maxsize=INDEX_CACHE_SIZE)
+def _load_index(user_id, tariff_version):
+    rows = db.fetchall(
+        "SELECT resource, zone, meter_id, valid_from, tiers FROM tariffs WHERE user_id = ? ORDER BY valid_from",
+        (user_id,)
+    )
+    return PriceIndex((resource, zone, meter_id, valid_from, json.loads(tiers))
+                      for resource, zone, meter_id, valid_from, tiers in rows)
+
+def price_index(user_id):
+    return _load_index(user_id, version(user_id))
+
+
+# === СТОИМОСТЬ ===
+def tiered_cost(tiers, before, amount):
+    # Стоимость amount единиц, если в этом месяце до них уже израсходовано before
+    cost = 0.0
+    lower = 0.0
+    for limit, price in tiers:
+        upper = float("inf") if limit is None else limit
+        used = min(before + amount, upper) - max(before, lower)
+        if used > 0:
+            cost += used * price
+        lower = upper
+    return cost
+
+def priced(index, meter, rows, month_before=0.0):
+    # rows — строки истории (date, value, delta, avg) по возрастанию даты;
+    # month_before — расход месяца первой строки до неё (readings.month_consumption_before).
+    # Даёт пары (строка, стоимость интервала или None)
+    month = None
+    for row in rows:
+        date_db, delta = row[0], row[2]
+        if month is not None and date_db[:7] != month:
+            month_before = 0.0
+        month = date_db[:7]
+        if delta is None:
+            yield row, None
+            continue
+        tiers = index.tiers(meter, date_db)
+        yield row, None if tiers is None else tiered_cost(tiers, month_before, delta)
+        month_before += delta
+
+
+# === ПОМЕСЯЧНАЯ СТОИМОСТЬ (МЕМОИЗАЦИЯ) ===
+# Ключ — версии показаний счётчика и тарифов пользователя: любое изменение
+# показаний или цен даёт новый ключ, устаревшие записи вытесняет LRU
+@functools.lru_cache(maxsize=COSTS_CACHE_SIZE)
+def _monthly_costs(user_id, meter, reading_version, tariff_version):
+    index = _load_index(user_id, tariff_version)
+    costs = {}
+    for row, cost in priced(index, meter, readings.iter_history(meter[0])):
+        if cost is not None:
+            month = row[0][:7]
+            costs[month] = costs.get(month, 0.0) + cost
+    return costs
+
+def monthly_costs(user_id, meter):
+    # {месяц: стоимость}; пустой словарь, если цен для счётчика нет
+    tariff_version = version(user_id)
+    if not _load_index(user_id, tariff_version).covers(meter):
+        return {}
+    return _monthly_costs(user_id, meter, readings.version(meter[0]), tariff_version)
@@ -0,0 +1,203 @@
+import csv
+import json
+import math
+from datetime import datetime
+
+import readings
+
+# === МАССОВЫЙ ИМПОРТ И ЭКСПОРТ ПОКАЗАНИЙ ===
+# Формат строки: ресурс, дата, показание и необязательное название счётчика —
+# CSV (resource,date,meter[,name]) или JSONL ({"resource": ..., "date": ..., "meter": ..., "name": ...}).
+# Ресурс — любое из RESOURCE_ALIASES, дата — ГГГГ-ММ-ДД или ДД.ММ.ГГГГ.
+# Без названия строка относится к единственному счётчику этого ресурса.
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 10
+FORMATS = ("csv", "jsonl")
+
+
+def detect_format(file_name):
+    name = (file_name or "").lower()
+    if name.endswith(".jsonl") or name.endswith(".json"):
+        return "jsonl"
+    if name.endswith(".csv") or name.endswith(".txt"):
+        return "csv"
+    return None
+
+def _parse_date(value):
+    value = value.strip()
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            date = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if 2000 <= date.year <= 2100:
+            return date.strftime("%Y-%m-%d")
+    raise ValueError(f"неверная дата «{value}»")
+
+def _records(lines, fmt):
+    # (номер строки, ресурс, дата, показание, название) — строки разбираются по одной
+    if fmt == "jsonl":
+        for line_no, line in enumerate(lines, start=1):
+            line = line.strip().lstrip("\ufeff")
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+                name = item.get("name")
+                yield line_no, str(item["resource"]), str(item["date"]), item["meter"], name and str(name)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                yield line_no, None, None, None, None
+    else:
+        for line_no, row in enumerate(csv.reader(lines), start=1):
+            if not row or not "".join(row).strip():
+                continue
+            if len(row) not in (3, 4):
+                yield line_no, None, None, None, None
+                continue
+            resource, date, meter = row[:3]
+            name = row[3].strip() if len(row) == 4 else None
+            resource = resource.lstrip("\ufeff")
+            if line_no == 1 and resource.strip().lower() == "resource":
+                continue  # заголовок
+            yield line_no, resource, date, meter, name or None
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = {}
+        self.errors = []
+        self.error_count = 0
+        self.skipped = 0  # строки, которые уже есть в базе
+        self.failed = None  # исключение, если файл не дочитан
+
+    @property
+    def total(self):
+        return sum(self.imported.values())
+
+    def error(self, line_no, text):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"строка {line_no}: {text}")
+
+
+def import_readings(lines, fmt, resolve):
+    # Один проход: каждая строка проверяется на монотонность относительно предыдущей
+    # принятой строки того же счётчика и уже внесённых показаний. Раньше или позже
+    # внесённых — сверка с первым/последним показанием; внутри истории — с соседями
+    # по дате, а строка, которая уже есть в базе, пропускается: после обрыва файл
+    # можно отправить ещё раз целиком.
+    # resolve(ресурс, название) -> meter_id; ValueError с текстом — строка пропускается
+    result = ImportResult()
+    existing = {}
+    last = {}  # meter_id -> (date, meter) последней принятой строки
+    first_imported = {}
+    batch = {}
+    committed = {}  # meter_id -> число записанных в базу строк
+
+    def flush(meter_id):
+        if batch.get(meter_id):
+            readings.insert_many(meter_id, batch[meter_id])
+            committed[meter_id] = committed.get(meter_id, 0) + len(batch[meter_id])
+            batch[meter_id] = []
+
+    try:
+        for line_no, resource, date_raw, meter_raw, name in _records(lines, fmt):
+            if resource is None:
+                result.error(line_no, "ожидается ресурс, дата, показание")
+                continue
+            try:
+                meter_id = resolve(resource.strip(), name)
+            except ValueError as e:
+                result.error(line_no, str(e))
+                continue
+            try:
+                date_db = _parse_date(str(date_raw))
+                meter_value = float(str(meter_raw).replace(",", "."))
+                if not math.isfinite(meter_value):
+                    # nan база хранит как NULL, а inf закрыл бы счётчику все следующие строки
+                    raise ValueError(meter_raw)
+            except ValueError as e:
+                result.error(line_no, str(e) if "дата" in str(e) else f"неверное показание «{meter_raw}»")
+                continue
+
+            if meter_id not in existing:
+                existing[meter_id] = readings.bounds(meter_id)
+            prev = last.get(meter_id)
+            if prev is not None and date_db <= prev[0]:
+                result.error(line_no, "строки счётчика должны идти по возрастанию даты без повторов")
+                continue
+            if prev is not None and meter_value < prev[1]:
+                result.error(line_no, "показания не могут уменьшаться")
+                continue
+            bounds = existing[meter_id]
+            if bounds is not None:
+                first_date, first_meter, last_date, last_meter = bounds
+                if date_db < first_date:
+                    if readings.archived_before(meter_id):
+                        # Раньше опорного показания — только архив, пересчитать его итоги нельзя
+                        result.error(line_no, "дата попадает в архивную часть истории")
+                        continue
+                    if meter_value > first_meter:
+                        result.error(line_no, "показания не могут уменьшаться")
+                        continue
+                elif date_db > last_date:
+                    if meter_value < last_meter:
+                        result.error(line_no, "показания не могут уменьшаться")
+                        continue
+                else:
+                    current = readings.find_reading(meter_id, date_db)
+                    if current is not None:
+                        if current != meter_value:
+                            result.error(line_no, "на эту дату уже внесено другое показание")
+                        else:
+                            last[meter_id] = (date_db, meter_value)
+                            result.skipped += 1
+                        continue
+                    if date_db < (readings.archived_before(meter_id) or ""):
+                        result.error(line_no, "дата попадает в архивную часть истории")
+                        continue
+                    before, after = readings.neighbours(meter_id, date_db)
+                    if (before is not None and meter_value < before) or (after is not None and meter_value > after):
+                        result.error(line_no, "показания не могут уменьшаться")
+                        continue
+
+            last[meter_id] = (date_db, meter_value)
+            first_imported.setdefault(meter_id, date_db)
+            batch.setdefault(meter_id, []).append((meter_value, date_db))
+            result.imported[meter_id] = result.imported.get(meter_id, 0) + 1
+            if len(batch[meter_id]) >= IMPORT_BATCH_SIZE:
+                flush(meter_id)
+
+        for meter_id in list(batch):
+            flush(meter_id)
+    except Exception as e:
+        # Обрыв скачивания или разбора: записанные пачки остаются, о них и сообщаем
+        result.failed = e
+        result.imported = committed
+    finally:
+        # Агрегаты пересчитываются и при обрыве — иначе записанные строки остались бы без расхода
+        for meter_id in committed:
+            readings.refresh_rollup(meter_id, first_imported[meter_id])
+    return result
+
+
+def export_readings(meters, out, fmt):
+    # meters — строки счётчиков (meter_id, resource, name, tariff);
+    # out — текстовый файл; строки пишутся прямо из курсора
+    count = 0
+    if fmt == "jsonl":
+        for meter_id, resource, name, _ in meters:
+            for date_db, meter_value in readings.iter_readings(meter_id):
+                out.write(json.dumps(
+                    {"resource": resource, "date": date_db, "meter": meter_value, "name": name}, ensure_ascii=False
+                ) + "\n")
+                count += 1
+    else:
+        writer = csv.writer(out)
+        writer.writerow(("resource", "date", "meter", "name"))
+        for meter_id, resource, name, _ in meters:
+            for date_db, meter_value in readings.iter_readings(meter_id):
+                writer.writerow((resource, date_db, meter_value, name))
+                count += 1
+    return count
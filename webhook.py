@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+from aiohttp import web
+
+import meter
+
+# === WEBHOOK-РЕЖИМ ===
+# Альтернатива bot.polling: Telegram присылает обновления на локальный aiohttp-сервер.
+# Обновления разных чатов обрабатываются параллельно, одного чата — строго по порядку.
+# Обработчики meter.py синхронные, поэтому выполняются в пуле потоков, а не в event loop.
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, например https://example.com/bot
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/bot")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+
+
+def _chat_id(update):
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    return None
+
+
+class ChatDispatcher:
+    def __init__(self, bot, executor):
+        self.bot = bot
+        self.executor = executor
+        self._queues = {}
+
+    def submit(self, update):
+        chat_id = _chat_id(update)
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[chat_id] = queue
+            asyncio.create_task(self._drain(chat_id, queue))
+        queue.put_nowait(update)
+
+    async def _drain(self, chat_id, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                update = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                # Между проверкой и удалением нет await — новое обновление не потеряется
+                del self._queues[chat_id]
+                return
+            try:
+                await loop.run_in_executor(self.executor, self.bot.process_new_updates, [update])
+            except Exception as e:
+                logging.error("Update %s processing failed: %s", update.update_id, e)
+
+
+async def handle_update(request):
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    update = telebot.types.Update.de_json(await request.json())
+    request.app["dispatcher"].submit(update)
+    return web.Response()
+
+
+def create_app(bot=None):
+    # Без bot — бот из meter.create_app() (база, логи, соединения)
+    bot = bot or meter.create_app()
+    # Обработчики выполняются в нашем пуле, а не во внутреннем пуле TeleBot
+    bot.threaded = False
+    executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix="update")
+    app = web.Application()
+    app["dispatcher"] = ChatDispatcher(bot, executor)
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+
+    async def on_cleanup(app):
+        executor.shutdown(wait=True)
+
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    app = create_app()
+    meter.start_background_jobs()
+    if WEBHOOK_URL:
+        meter.bot.remove_webhook()
+        meter.bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    logging.info("Bot started in webhook mode on %s:%s%s.", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT, print=None)